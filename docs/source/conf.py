@@ -25,6 +25,7 @@ sys.path.insert(0, scripts)
 try:
     os.symlink(scripts+os.sep+'ezscatter', scripts+os.sep+'_ezscatter.py')
     os.symlink(scripts+os.sep+'ezpool', scripts+os.sep+'_ezpool.py')
+    os.symlink(scripts+os.sep+'ezserver', scripts+os.sep+'_ezserver.py')
     os.symlink(scripts+os.sep+'mpi_world', scripts+os.sep+'_mpi_world.py')
 except:
     pass
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+#
+# Author: Mike McKerns (mmckerns @caltech and @uqfoundation)
+# Copyright (c) 2026 The Uncertainty Quantification Foundation.
+# License: 3-clause BSD.  The full license text is available at:
+#  - https://github.com/uqfoundation/pyina/blob/master/LICENSE
+
+__doc__ = """
+# benchmark the mapping strategies, sweeping over the number of tasks, the
+# cost of each task (and the variance of the cost), the size of the payload,
+# and the number of ranks. Each 'case' is timed with:
+#   - mpi_pool: pyina.mpi_pool.parallel_map, in a running mpi world
+#   - mpi_scatter: pyina.mpi_scatter.parallel_map, in a running mpi world
+#   - Pool, Scatter: pyina.launchers Pool(nodes).map (i.e. launching mpi)
+# To run:  (results are written as json, to compare between commits)
+
+python benchmark.py --output new.json
+python benchmark.py --compare old.json new.json
+
+# or, to time only the strategies in a running mpi world:
+alias mpython='mpiexec -np [#nodes] `which python`'
+mpython benchmark.py --world --output world.json
+"""
+import os
+import sys
+import json
+import time
+import itertools
+
+# the parameters of each case, and the default values of the sweep
+KEYS = ('strategy', 'nodes', 'tasks', 'duration', 'cv', 'payload')
+SWEEP = dict(nodes=[2, 4], tasks=[16, 256], duration=[0., 1e-3],
+             cv=[0., 1.], payload=[8, 1 << 16])
+QUICK = dict(nodes=[2], tasks=[16], duration=[1e-3], cv=[0., 1.], payload=[8])
+
+
+def task(duration, payload):
+    """spin for duration seconds, then return a payload of the same size"""
+    import time
+    stop = time.perf_counter() + duration
+    while time.perf_counter() < stop:
+        pass
+    return payload
+
+
+def inputs(tasks, duration, cv, payload, seed=0):
+    """get the (durations, payloads) for the tasks in a case
+
+tasks: int number of tasks
+duration: float mean duration of a task, in seconds
+cv: float coefficient of variation of the duration (i.e. std/mean)
+payload: int size in bytes of the input and the result of each task"""
+    import numpy as np
+    random = np.random.RandomState(seed)
+    if cv and duration: # a lognormal distribution with the given mean and cv
+        sigma = np.sqrt(np.log1p(cv**2))
+        mu = np.log(duration) - sigma**2/2
+        durations = random.lognormal(mu, sigma, tasks)
+    else:
+        durations = np.full(tasks, duration)
+    payloads = [np.zeros(max(payload // 8, 1)) for i in range(tasks)]
+    return durations.tolist(), payloads
+
+
+def cases(sweep):
+    """iterate over the (tasks, duration, cv, payload) for each case"""
+    keys = ('tasks', 'duration', 'cv', 'payload')
+    for values in itertools.product(*(sweep[key] for key in keys)):
+        if not values[1] and values[2]: continue # no variance without cost
+        yield dict(zip(keys, values))
+
+
+def record(strategy, nodes, case, times):
+    """build a result, from the best of the times for the case"""
+    best = min(times)
+    result = dict(strategy=strategy, nodes=nodes, **case)
+    result.update(time=best, times=times, throughput=case['tasks']/best)
+    result['efficiency'] = case['tasks'] * case['duration'] / (best * nodes)
+    return result
+
+
+def run_world(sweep, repeat=3):
+    """time each case with the strategies in the running mpi world
+
+returns the list of results on the master, and None on the workers"""
+    from pyina import mpi, mpi_pool, mpi_scatter
+    world = mpi.world
+    results = []
+    for case in cases(sweep):
+        args = inputs(**case)
+        for name, strategy in (('mpi_pool', mpi_pool), ('mpi_scatter', mpi_scatter)):
+            times = []
+            for i in range(repeat):
+                world.Barrier()
+                start = mpi.MPI.Wtime()
+                strategy.parallel_map(task, *args)
+                world.Barrier()
+                times.append(mpi.MPI.Wtime() - start)
+            results.append(record(name, world.size, case, times))
+    return results if world.rank == 0 else None
+
+
+def run_mapper(sweep, repeat=3):
+    """time each case with the launchers, for each number of nodes"""
+    from pyina.launchers import Pool, Scatter
+    results = []
+    for nodes in sweep['nodes']:
+        for case in cases(sweep):
+            args = inputs(**case)
+            for name, mapper in (('Pool', Pool), ('Scatter', Scatter)):
+                pool = mapper(nodes)
+                times = []
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    pool.map(task, *args)
+                    times.append(time.perf_counter() - start)
+                results.append(record(name, nodes, case, times))
+    return results
+
+
+def launch_world(nodes, sweep, repeat=3):
+    """time each case in a new mpi world with the given number of nodes"""
+    import tempfile, subprocess
+    from pyina.tools import which_mpirun
+    mpirun = which_mpirun() or 'mpiexec'
+    output = tempfile.mktemp(suffix='.json')
+    command = [mpirun, '-np', str(nodes), sys.executable, __file__, '--world',
+               '--repeat', str(repeat), '--sweep', json.dumps(sweep),
+               '--output', output]
+    try:
+        subprocess.check_call(command)
+        with open(output) as file:
+            return json.load(file)['results']
+    finally:
+        if os.path.exists(output): os.remove(output)
+
+
+def metadata():
+    """get a description of the host and the versions being benchmarked"""
+    import platform, subprocess
+    import numpy, mpi4py, dill, pyina
+    try:
+        directory = os.path.dirname(os.path.abspath(pyina.__file__))
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                 cwd=directory, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(date=time.strftime('%Y-%m-%dT%H:%M:%S'), commit=commit,
+                host=platform.node(), python=platform.python_version(),
+                pyina=getattr(pyina, '__version__', None), numpy=numpy.__version__,
+                mpi4py=mpi4py.__version__, dill=dill.__version__,
+                mpi=mpi4py.MPI.Get_library_version().strip('\x00 \n'))
+
+
+def compare(old, new):
+    """print the ratio of the times (new/old) for the cases in both files"""
+    with open(old) as file: old = json.load(file)['results']
+    with open(new) as file: new = json.load(file)['results']
+    key = lambda result: tuple(result[k] for k in KEYS)
+    old = dict((key(result), result) for result in old)
+    print(' '.join('%12s' % k for k in KEYS + ('old', 'new', 'ratio')))
+    for result in new:
+        base = old.get(key(result), None)
+        if base is None: continue
+        ratio = result['time'] / base['time']
+        print(' '.join('%12s' % v for v in key(result)) + ' %12.4g %12.4g %12.3f' %
+              (base['time'], result['time'], ratio))
+    return
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+             formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='write the results to a json file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare the results in two json files')
+    parser.add_argument('--world', action='store_true',
+                        help='only time the strategies in this mpi world')
+    parser.add_argument('--quick', action='store_true',
+                        help='time a small sweep of cases')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='the number of times to time each case')
+    parser.add_argument('--sweep', type=json.loads, default=None,
+                        help='the values to sweep, as a json dict of lists')
+    options = parser.parse_args()
+
+    if options.compare:
+        compare(*options.compare)
+        sys.exit()
+    sweep = dict(QUICK if options.quick else SWEEP)
+    sweep.update(options.sweep or {})
+
+    if options.world: # in a running mpi world
+        results = run_world(sweep, options.repeat)
+        if results is None: sys.exit() # on the workers
+    else: # launch an mpi world for each number of nodes, then use the mapper
+        results = []
+        for nodes in sweep['nodes']:
+            results.extend(launch_world(nodes, sweep, options.repeat))
+        results.extend(run_mapper(sweep, options.repeat))
+    output = dict(meta=metadata(), sweep=sweep, results=results)
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(output, file, indent=1)
+    else:
+        print(json.dumps(output, indent=1))
+
+
+# end of file
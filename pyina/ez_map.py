@@ -64,9 +64,25 @@ from .launchers import (launch, mpirun_tasks, srun_tasks, aprun_tasks,
                         aprun_launcher, torque_launcher, moab_launcher,
                         sbatch_launcher)
 from .schedulers import torque_scheduler, moab_scheduler, sbatch_scheduler
+from .tools import load_results
 
 HOLD = []
-sleeptime = 30  #XXX: the time between checking for results
+sleeptime = 30  #XXX: the maximum time between checking for results
+
+def _monitor(launcher):
+    """get a scheduler that can check on jobs submitted by the given launcher"""
+    from .schedulers import Scheduler, Torque, Moab, Sbatch
+    schedulers = {torque_launcher: Torque, moab_launcher: Moab,
+                  sbatch_launcher: Sbatch}
+    return schedulers.get(launcher, Scheduler)()
+
+def _timeout(kwds):
+    """get the timeout (in seconds) from the given keywords"""
+    timeout = kwds.get('timeout', None)
+    if isinstance(timeout, str):
+        from pyina.tools import isoseconds
+        timeout = isoseconds(timeout)
+    return timeout
 
 #def ez_map(func, arglist, nodes=None, launcher=None, mapper=None):
 def ez_map(func, *arglist, **kwds):
@@ -83,8 +99,8 @@ Further Input:
     mapper -- the mapper object
     timelimit -- string representation of maximum run time (e.g. '00:02')
     queue -- string name of selected queue (e.g. 'normal')
+    timeout -- maximum time to wait for the results of a scheduled job
     """
-    import dill as pickle
     import os.path, tempfile, subprocess
     from pyina.tools import which_strategy
     # mapper = None (allow for use of default mapper)
@@ -192,20 +208,21 @@ Further Input:
 
     if launcher in [torque_launcher, moab_launcher, sbatch_launcher] \
     or scheduler in [torque_scheduler, moab_scheduler, sbatch_scheduler]:
-        import time                              #BLOCKING
-        while (not os.path.exists(resfilename)): #XXX: or out* to confirm start
-            time.sleep(sleeptime) #XXX: wait for results... may infinite loop?
-        subprocess.call('rm -f %s' % jobfilename, shell=True)
-        subprocess.call('rm -f %s' % outfilename, shell=True)
-        subprocess.call('rm -f %s' % errfilename, shell=True)
+        try: # block until the results are written, or the job has failed
+            _monitor(launcher)._wait(resfilename, _timeout(kwds), jobfilename,
+                                     maxwait=sleeptime)
+        finally:
+            subprocess.call('rm -f %s' % jobfilename, shell=True)
+            subprocess.call('rm -f %s' % outfilename, shell=True)
+            subprocess.call('rm -f %s' % errfilename, shell=True)
 
     # debuggery... output = function(inputs)
    #subprocess.call('cp -f %s modfile.py' % modfile.name, shell=True) # getsource; FUNC=func
    #subprocess.call('cp -f %s argfile.py' % argfile.name, shell=True) # pickled list of inputs
    #subprocess.call('cp -f %s resfile.py' % resfilename, shell=True)  # pickled list of output
 
-    # read result back
-    res = pickle.load(open(resfilename,'rb'))
+    # read result back (the launch is done, so raise IOError if incomplete)
+    res = load_results(resfilename, alive=lambda: False)
     subprocess.call('rm -f %s' % resfilename, shell=True)
     subprocess.call('rm -f %sc' % modfile.name, shell=True)
     modfile.close(); argfile.close() # pypy removes closed tempfiles
@@ -227,8 +244,8 @@ Further Input:
     mapper -- the mapper object
     timelimit -- string representation of maximum run time (e.g. '00:02')
     queue -- string name of selected queue (e.g. 'normal')
+    timeout -- maximum time to wait for the results of a scheduled job
 """
-    import dill as pickle
     import os.path, tempfile, subprocess
     from pyina.tools import which_strategy
     # mapper = None (allow for use of default mapper)
@@ -333,15 +350,16 @@ Further Input:
 
     if launcher in [torque_launcher, moab_launcher, sbatch_launcher] \
     or scheduler in [torque_scheduler, moab_scheduler, sbatch_scheduler]:
-        import time                              #BLOCKING
-        while (not os.path.exists(resfilename)): #XXX: or out* to confirm start
-            time.sleep(sleeptime) #XXX: wait for results... may infinite loop?
-        subprocess.call('rm -f %s' % jobfilename, shell=True)
-        subprocess.call('rm -f %s' % outfilename, shell=True)
-        subprocess.call('rm -f %s' % errfilename, shell=True)
-
-    # read result back
-    res = pickle.load(open(resfilename,'rb'))
+        try: # block until the results are written, or the job has failed
+            _monitor(launcher)._wait(resfilename, _timeout(kwds), jobfilename,
+                                     maxwait=sleeptime)
+        finally:
+            subprocess.call('rm -f %s' % jobfilename, shell=True)
+            subprocess.call('rm -f %s' % outfilename, shell=True)
+            subprocess.call('rm -f %s' % errfilename, shell=True)
+
+    # read result back (the launch is done, so raise IOError if incomplete)
+    res = load_results(resfilename, alive=lambda: False)
     subprocess.call('rm -f %s' % resfilename, shell=True)
     modfile.close(); argfile.close() # pypy removes closed tempfiles
     return res
@@ -150,6 +150,7 @@ class ParallelMapper(Mapper): #FIXME FIXME: stopped docs here
 Mapper base class for pipe-based mapping with mpi4py.
     """
     __nodes = None
+    __hosts = None
     def __init__(self, *args, **kwds):
         """\nNOTE: if number of nodes is not given, will try to grab the number
 of nodes from the associated scheduler, and failing will count the local cpus.
@@ -220,12 +221,29 @@ NOTES:
         if isinstance(tasks, type('')) and tasks.startswith(('"',"'")):
             tasks = tasks[1:-1]
         return tasks
+    def _hierarchy(self):
+        """get the (tasks, ppn) to launch one task per node, each with ppn procs
+
+compute nodes and ppn from node string of pattern = N[:TYPE][:ppn=P]. For
+example, with nodes="3:core4:ppn=2", yields (njobs("3"), 2). As with njobs,
+'cpp=' is a multiplier. If the node string has no 'ppn=', then ppn is 1.
+        """
+        nodes, ppn = self.__hosts or (self.nodes, 1)
+        return self.njobs(nodes), ppn
     def __get_nodes(self):
         """get the number of nodes in the pool"""
         return self.__nodes
     def __set_nodes(self, nodes):
         """set the number of nodes in the pool"""
         self.__nodes = self.njobs(nodes)
+        nodestr = str(nodes)
+        if nodestr.startswith(('"',"'")): nodestr = nodestr[1:-1]
+        nodelst = nodestr.split(",")[0].split(":")
+        ppn = 1
+        for i in nodelst:
+            if i.startswith(('ppn=','cpp=')):
+                ppn *= int(i.split('=')[1])
+        self.__hosts = (nodelst[0], ppn)
         return
     # interface
     nodes = property(__get_nodes, __set_nodes)
@@ -253,6 +271,13 @@ Node string accepts fine-grained controls ('ppn=' and 'cpp=') as a multiplier
                 ppn *= int(i.split('=')[1])   #XXX: no standard threads/nodes
         tasks = n*ppn
         return str(tasks)
+    def _hierarchy(self):
+        """get the (tasks, ppn) to launch one task per node, each with ppn procs
+
+For example, with nodes="3:core4:ppn=2", yields ('3 --map-by ppr:1:node', 2).
+        """
+        tasks, ppn = ParallelMapper._hierarchy(self)
+        return '%s --map-by ppr:1:node' % tasks, ppn
     def _launcher(self, kdict={}):
         """prepare launch command for parallel execution using mpirun
 
@@ -300,6 +325,13 @@ Node string accepts fine-grained controls, and ('cpp=') a multiplier
     def _nodes(self, tasks=None):
         if tasks is None: tasks = self.nodes
         return "%s" % Sbatch()._nodes(tasks)
+    def _hierarchy(self):
+        """get the (tasks, ppn) to launch one task per node, each with ppn procs
+
+For example, with nodes="3:ppn=2", yields ('3 -N3 --ntasks-per-node=1', 2).
+        """
+        tasks, ppn = ParallelMapper._hierarchy(self)
+        return '%s -N%s --ntasks-per-node=1' % (tasks, tasks), ppn
     def _launcher(self, kdict={}):
         """prepare launch for parallel execution using srun
 
@@ -396,6 +428,13 @@ Node string accepts fine-grained controls, and ('cpp=') a multiplier
                     nodes = ("'%s:ppn=%s'" % (nodes, nproc)).strip()
         if isinstance(nodes, type('')) and nodes.startswith(('"',"'")): nodes = nodes[1:-1]
         return nodes
+    def _hierarchy(self):
+        """get the (tasks, ppn) to launch one task per node, each with ppn procs
+
+For example, with nodes="3:core4:ppn=2", yields ('3 -N 1', 2).
+        """
+        tasks, ppn = ParallelMapper._hierarchy(self)
+        return '%s -N 1' % tasks, ppn
     def _launcher(self, kdict={}):
         """prepare launch for parallel execution using aprun
 
@@ -13,6 +13,9 @@ Pipe methods provided:
 
 Map methods provided:
     map            - blocking and ordered worker pool        [returns: list]
+    imap           - non-blocking and ordered worker pool    [returns: iterator]
+    uimap          - non-blocking and unordered worker pool  [returns: iterator]
+    amap           - asynchronous worker pool                [returns: object]
 
 Base classes:
     Mapper         - base class for pipe-based mapping
@@ -53,7 +56,7 @@ Notes
 See pyina.launchers and pyina.schedulers for more launchers and schedulers.
 
 """
-__all__ = ['_save', '_debug', 'Mapper', 'world']
+__all__ = ['_save', '_debug', 'Mapper', 'MapResult', 'world']
 
 
 ##### shortcuts #####
@@ -61,20 +64,23 @@ from mpi4py import MPI
 world = MPI.COMM_WORLD
 # (also: world.rank, world.size)
 import dill
-try:
-    getattr(MPI,'pickle',getattr(MPI,'_p_pickle',None)).dumps = dill.dumps
-    getattr(MPI,'pickle',getattr(MPI,'_p_pickle',None)).loads = dill.loads
-except AttributeError:
-    pass
 #####################
 
-from subprocess import Popen, call
+from subprocess import Popen, PIPE, call
 from pathos.abstract_launcher import AbstractWorkerPool
 from pathos.helpers import cpu_count
 import os, os.path, sys
+import json
 import tempfile
+import weakref
 from dill.temp import dump, dump_source
 from pyina.tools import which_python, which_launcher, which_strategy
+from pyina.tools import which_server, results_ready, iload_results
+from pyina.tools import open_signal, close_signal, wait_signal
+from pyina.tools import dump_args, dump_sharded, dump_arrays, get_serializer
+from pyina.tools import get_compressor, compress, load_stats, dump_trace
+from pyina.tools import CostModel
+from time import time
 
 _HOLD = []
 _SAVE = [False]
@@ -99,6 +105,73 @@ def _debug(boolean):
     return
 
 
+# the pickled funcs, cached as {filename: number of maps using the file}
+from collections import OrderedDict
+_FUNCS = OrderedDict()
+_MAXFUNCS = [32] # the most files kept in the cache
+
+class _FuncFile(object):
+    """handle to a cached pickled function, released when closed"""
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+    def close(self):
+        if self.closed: return
+        self.closed = True
+        if self.name in _FUNCS: _FUNCS[self.name] -= 1
+        return
+
+def _cache(func, workdir):
+    """pickle.dump function to a file in workdir, named by the pid and hash
+
+if the file is already in the cache, the file is reused (and not rewritten);
+otherwise, the least recently used files not in use by a map are removed"""
+    import hashlib
+    pickled = dill.dumps(func)
+    # the pid is in the name, so other processes never remove the file
+    name = 'func%s%s.pik' % (_pid, hashlib.sha1(pickled).hexdigest())
+    name = os.path.join(os.path.abspath(workdir), name)
+    if name in _FUNCS:
+        _FUNCS.move_to_end(name)
+    else:
+        unused = [i for (i,n) in _FUNCS.items() if not n]
+        for i in unused[:max(len(_FUNCS) - _MAXFUNCS[0] + 1, 0)]:
+            del _FUNCS[i]
+            if os.path.exists(i): os.remove(i)
+        _FUNCS[name] = 0
+    if not os.path.exists(name): # write the file, then move it into place
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(name), \
+                                         delete=False) as file:
+            file.write(pickled)
+        os.replace(file.name, name)
+    _FUNCS[name] += 1
+    return _FuncFile(name)
+
+def _clear_cache():
+    """remove the files of all cached functions"""
+    for name in list(_FUNCS):
+        if os.path.exists(name): os.remove(name)
+    _FUNCS.clear()
+    return
+import atexit
+atexit.register(_clear_cache)
+
+# the file where the costs of maps are cached (see Mapper and CostModel)
+_COSTS = [os.path.join(os.path.expanduser('~'), '.pyina', 'costs.json')]
+
+def _costkey(func):
+    """get the name of a function, as used to cache the cost of the function
+
+NOTE: if the function has code (e.g. is not a builtin), the key includes the
+file and first line number of the code, so each lambda has its own entry."""
+    name = getattr(func, '__qualname__', None) or \
+           getattr(func, '__name__', None) or type(func).__name__
+    name = '%s.%s' % (getattr(func, '__module__', None) or '', name)
+    code = getattr(func, '__code__', None)
+    if code is None: return name
+    return '%s@%s:%s' % (name, code.co_filename, code.co_firstlineno)
+
+
 _pid = '.' + str(os.getpid()) + '.'
 defaults = {
     'nodes' : str(cpu_count()),
@@ -130,6 +203,41 @@ If source is not given, will attempt to minimially use TemporaryFiles.
 If workdir is not given, will default to scheduler's workdir or $WORKDIR.
 If scheduler is not given, will default to only run on the current node.
 If timeout is not given, will default to scheduler's timelimit or INF.
+If persistent is True, will launch the mpi world once, and then reuse it for
+all maps until the pool is closed (this can not be used with a scheduler).
+If shared is True, will load the arguments once on each node into shared
+memory, where ndarrays in the arguments are read-only and not copied.
+If sharded is True, will write the arguments so each rank reads only the
+slices it needs. If sharded is not given, will shard for 'scatter-gather'.
+If mmap is True, will save ndarray arguments as '.npy' files, which are read
+as copy-on-write memory maps, thus only the rows that are used are read by
+each rank (and the page cache is shared by the ranks on a node). If mmap is not given, will
+use memory maps when any of the arguments is an ndarray.
+If cache is False, will pickle the function to a new file for each map.
+Otherwise, the pickled function is reused by any map of the same function.
+If serializer is given, will use the named serializer (e.g. 'pickle'), or a
+tuple of (dumps, loads) functions, for the objects sent with mpi, and for the
+results file. The function, and the file of arguments, are always pickled
+with dill, as the serializer is sent with the arguments (thus is not known to
+the mpi world until the arguments are loaded). The default serializer is
+'dill' (see pyina.tools.get_serializer).
+If compression is given, will compress the arguments and results files with
+the named compressor (e.g. 'zlib'), or with the first installed of 'zstd',
+'lz4' and 'zlib' if compression is True. Arguments that are shared or memory
+mapped are not compressed, nor is data smaller than 64 KB.
+If timing is True, will record the time spent on each task and message in the
+mpi world, and the stats for the last map are then available as the 'stats'
+attribute (see pyina.tools.merge_stats). The time spent in each phase of the
+last map is available as the 'phases' attribute (see the "map" method).
+If fallback is True, will learn the cost of each function and the overhead of
+launching from the previous maps (cached in ~/.pyina/costs.json), and a map
+that is predicted to be faster in-process or on a local process pool is run
+there instead of being launched (see pyina.tools.CostModel). If fallback is
+'serial' or 'local', will always run the map in-process or on a local process
+pool. If fallback is False, will always launch the map.
+If hierarchical is True, will launch one task per node, where each task maps
+its jobs on a local process pool with ppn processes, where ppn is given by the
+node string (e.g. nodes='4:ppn=8'). The master then receives fewer messages.
 
 For more details, see the docstrings for the "map" method, or the man page
 for the associated launcher (e.g mpirun, mpiexec).
@@ -138,8 +246,27 @@ for the associated launcher (e.g mpirun, mpiexec).
         self.scheduler = kwds.get('scheduler', None)
         self.scatter = True #bool(kwds.get('scatter', True))
         self.source = bool(kwds.get('source', False))
+        self.shared = bool(kwds.get('shared', False))
+        self.sharded = kwds.get('sharded', None)
+        self.mmap = kwds.get('mmap', None)
+        self.cache = bool(kwds.get('cache', True))
+        self.serializer = kwds.get('serializer', None)
+        get_serializer(self.serializer) # raise an error if unavailable
+        self.compression = kwds.get('compression', None)
+        if self.compression: # raise an error if unavailable
+            get_compressor(self.compression)
+        self.timing = bool(kwds.get('timing', False))
+        self.stats = None # the stats of the last map (if timing)
+        self.phases = None # the time spent in each phase of the last map
+        self.fallback = kwds.get('fallback', False)
+        if self.fallback not in (False, True, 'serial', 'local'):
+            raise ValueError("fallback must be a bool, 'serial', or 'local'")
+        self.hierarchical = bool(kwds.get('hierarchical', False))
         self.workdir = kwds.get('workdir', None)
         self.timeout = kwds.get('timeout', None)
+        self.persistent = bool(kwds.get('persistent', False))
+        self._server = self._command = None
+        self._pending = {} # results files requested from the server
         if self.timeout == None:
             if self.scheduler:
                 from pyina.tools import isoseconds
@@ -164,13 +291,106 @@ for the associated launcher (e.g mpirun, mpiexec).
         [env.update({k:v}) for (k,v) in self.__dict__.items() if k in defaults]
         [env.update({'nodes':v}) for (k,v) in self.__dict__.items() if k.endswith('nodes')] # deal with self.__nodes
         return env
-    def __launch(self, command):
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+        self.join()
+        return
+    def __launch(self, command, **kwds):
         """launch mechanism for prepared launch command"""
         executable = command.split("|")[-1].split()[0]
         from pox import which
         if not which(executable):
             raise IOError("launch failed: %s not found" % executable)
-        return Popen([command], shell=True) #FIXME: shell=True is insecure
+        return Popen([command], shell=True, **kwds) #FIXME: shell=True is insecure
+    def _serve(self, command=None):
+        """get the server for the persistent mpi world, launching it if needed
+
+command: the launch command for the server [default: the current command]
+
+NOTE: the server is relaunched if it has exited, or if the command has changed
+        """
+        server = self._server
+        if server is not None:
+            if server.stdin.closed:
+                raise ValueError("Pool not running")
+            if server.poll() is not None or \
+               (command is not None and command != self._command):
+                self.clear()
+                server = None
+        if server is None and command is not None:
+            server = self.__launch(command, stdin=PIPE, stdout=PIPE, \
+                                   universal_newlines=True)
+            self._server, self._command = server, command
+        return server
+    def _request(self, server, *request):
+        """send a map request to the server (without waiting for the results)
+
+server: the server for the persistent mpi world
+request: strategy, path to function, path to inputs, path to results, workdir
+        """
+        server.stdin.write(json.dumps(request) + '\n')
+        server.stdin.flush()
+        self._pending[request[3]] = False
+        return
+    def _response(self, server, resfilename):
+        """read the server's output, until the given results file is named
+
+server: the server for the persistent mpi world
+resfilename: path to the results of a request sent to the server
+        """
+        pending = self._pending
+        # the server echoes the results file name when the results are ready
+        while not pending.get(resfilename, True) and not server.stdout.closed:
+            line = server.stdout.readline()
+            if not line: break # the server has exited
+            name = line.rstrip('\n')
+            if name not in pending: sys.stdout.write(line)
+            elif pending[name] is False: pending[name] = True
+            else: self._release(*pending.pop(name)) # an abandoned map
+        pending.pop(resfilename, None)
+        return
+    def close(self):
+        """close the persistent mpi world to new maps"""
+        server = self._server
+        if server is not None and not server.stdin.closed:
+            server.stdin.close() # the server exits at the end of its input
+        return
+    def join(self):
+        """wait for the persistent mpi world to exit (after close)"""
+        server = self._server
+        if server is None: return
+        if not server.stdin.closed:
+            raise ValueError("Pool is still running")
+        server.wait()
+        server.stdout.close()
+        self._server = None
+        # the server is done, so release the files of any abandoned maps
+        for name, files in list(self._pending.items()):
+            if isinstance(files, tuple): self._release(*self._pending.pop(name))
+        return
+    def terminate(self):
+        """stop the persistent mpi world, without waiting for outstanding maps"""
+        server = self._server
+        if server is None: return
+        server.terminate()
+        server.stdin.close()
+        self.join()
+        return
+    def clear(self):
+        """shut down the persistent mpi world, if one is running"""
+        self.close()
+        self.join()
+        return
+    def restart(self, force=False):
+        """restart the persistent mpi world
+
+if force=False, wait for outstanding maps before restarting"""
+        command = self._command
+        if force: self.terminate()
+        else: self.clear()
+        return self._serve(command)
     def _launcher(self, kdict={}):
         """prepare launch command based on current settings
 
@@ -182,10 +402,35 @@ equivalent to:  NotImplemented
         return str
     def _pickleargs(self, args, kwds):
         """pickle.dump args and kwds to tempfile"""
-        # standard pickle.dump of inputs to a NamedTemporaryFile
-        return dump((args, kwds), suffix='.arg', dir=self.workdir)
+        sharded = self.scatter if self.sharded is None else self.sharded
+        mmap = self.mmap
+        if mmap is None:
+            from numpy import ndarray
+            mmap = any(type(arg) is ndarray for arg in args)
+        if not self.shared and not mmap and not sharded and \
+           not self.compression:
+            # standard pickle.dump of inputs to a NamedTemporaryFile
+            return dump((args, kwds), suffix='.arg', dir=self.workdir)
+        file = tempfile.NamedTemporaryFile(suffix='.arg', dir=self.workdir)
+        if self.shared:
+            # write ndarrays as raw buffers, to be shared by the ranks on a node
+            dump_args(args, kwds, file)
+        elif mmap:
+            # write ndarrays as '.npy' files, to be memory mapped by the ranks
+            dump_arrays(args, kwds, file)
+        elif sharded:
+            # write args in indexed blocks, so each rank reads only its slice
+            dump_sharded(args, kwds, file, compression=self.compression)
+        else:
+            # write the compressed pickle of inputs
+            file.write(compress(dill.dumps((args, kwds)), self.compression))
+        file.flush()
+        return file
     def _modularize(self, func):
         """pickle.dump function to tempfile"""
+        if not self.source and self.cache:
+            # pickle.dump to a file that is reused for the same pickle
+            return _cache(func, self.workdir)
         if not self.source:
             # standard pickle.dump of inputs to a NamedTemporaryFile
             return dump(func, suffix='.pik', dir=self.workdir)
@@ -229,7 +474,9 @@ equivalent to:  NotImplemented
     - path to pickled function inputs (e.g. 'my_args.arg')
         """
         resfilename = args[0]
-        call('rm -f %s' % resfilename, shell=True)
+        call('rm -f %s %s.stats' % (resfilename, resfilename), shell=True)
+        if len(args) > 2: # remove any '.npy' files saved with the inputs
+            call('rm -f %s.*.npy' % args[2], shell=True)
         if not self.source:
             # do nothing
             return
@@ -237,31 +484,164 @@ equivalent to:  NotImplemented
         argfilename = args[2]
         call('rm -f %sc' % modfilename, shell=True)
         return
-    def map(self, func, *args, **kwds):
+    def _hierarchy(self):
+        """get the (tasks, ppn) to launch one task per node (see hierarchical)"""
+        return self.nodes, 1
+    def _launchname(self):
+        """get the name of the launcher, as used to cache the launch overhead"""
+        name = '%s(%s)' % (self.__class__.__name__, self.nodes)
+        return name + ' persistent' if self.persistent else name
+    def _size(self):
+        """get the number of processes launched for a map"""
+        try:
+            return max(int(self.nodes), 1)
+        except (TypeError, ValueError):
+            return 1
+    def _where(self, func, args):
+        """choose where to run a map: 'serial', 'local', or None (to launch)"""
+        if self.fallback in ('serial', 'local'): return self.fallback
+        if self.fallback is not True or not args: return None
+        try:
+            nitems = len(args[0])
+        except TypeError: # the cost can't be predicted
+            return None
+        model = CostModel(_COSTS[0])
+        return model.choose(_costkey(func), self._launchname(), nitems, \
+                            self._size(), cpu_count())
+    def _learn(self, key, launcher, nitems, nodes, elapsed, overhead=None):
+        """update the cached costs with the time of a map (see CostModel)"""
+        model = CostModel(_COSTS[0])
+        model.update(key, launcher, nitems, nodes, elapsed, overhead)
+        try:
+            model.save()
+        except (IOError, OSError): # the costs are not cached
+            log.info('costs not saved to %s' % _COSTS[0])
+        return
+    def _local(self, where, func, args):
+        """run a map in-process ('serial'), or on a local process pool ('local')"""
+        key = _costkey(func)
+        nitems = len(args[0]) if args and hasattr(args[0], '__len__') else 0
+        learn = self.fallback is True
+        start = time()
+        if where == 'serial':
+            results = list(map(func, *args))
+            result = _LocalResult(self, results, start)
+            if learn: self._learn(key, 'serial', nitems, 1, result.phases['total'], 0.)
+            return result
+        from pathos.pools import ProcessPool
+        ncpus = cpu_count()
+        result = _LocalResult(self, None, start)
+        def done(results): # record the time of the map, then learn from it
+            result._done()
+            if learn: self._learn(key, 'local', nitems, ncpus, result.phases['total'])
+        result._result = ProcessPool(ncpus).amap(func, *args, callback=done)
+        return result
+    def amap(self, func, *args, **kwds):
         """
 The function 'func', it's arguments, and the results of the map are all stored
 and shipped across communicators as pickled strings.
 
 Optional Keyword Arguments:
     - onall  = if True, include master as a worker       [default: True]
+    - chunksize  = number of jobs sent to a worker at a time  [default: None]
+    - schedule  = policy for sizing the chunks            [default: 'dynamic']
+    - prefetch  = number of chunks queued on each worker  [default: 1]
+    - collective  = if True, gather with MPI collectives  [default: True]
+    - weights  = cost of each job, or a function of the job's arguments
+    - trace  = path to write a timeline of the map        [default: None]
 
 NOTE: 'onall' defaults to True for both the scatter-gather and the worker
 pool strategies. A worker pool with onall=True may have added difficulty
 in pickling functions, due to asynchronous message passing with itself.
 
+NOTE: 'chunksize', 'schedule', and 'prefetch' are only used by the worker
+pool strategy. If chunksize is None, it is derived from the number of jobs
+and the size of the world. The schedule is one of 'static', 'dynamic',
+'guided', or 'adaptive', where 'guided' and 'adaptive' shrink the chunks as
+the remaining jobs drop, and 'adaptive' also sizes each chunk by the worker's
+throughput. With prefetch > 1, each worker has its next chunk queued while
+it computes.
+
+NOTE: 'collective' and 'weights' are only used by the scatter-gather
+strategy. With collective=True, the results are gathered to the master with
+a single collective operation instead of with a message from each worker.
+If weights are given, the jobs are split into contiguous partitions of
+near-equal total cost, instead of near-equal number of jobs.
+
+NOTE: with hierarchical=True (see __init__), one task is launched on each
+node (i.e. the launcher is given a per-node placement, see _hierarchy), and
+the jobs of each task are split across a local pool of ppn processes (i.e.
+'ppn' is passed to the strategy).
+
+NOTE: with fallback (see __init__), a map may be run in-process or on a local
+process pool instead of being launched, and the keyword arguments are ignored.
+
+NOTE: with persistent=True (see __init__), the mpi world is launched on
+the first map, and each map is then sent to the running world as a request.
+This avoids the cost of launching mpi and python for each map.
+
+NOTE: if trace is given, the map is timed (as with timing=True, see __init__)
+and a timeline is written to the trace file in the Chrome trace event format
+(e.g. for chrome://tracing or https://ui.perfetto.dev), with a track for each
+rank, and a span for loading the arguments, each task, and each message.
+
+NOTE: the time spent in each phase of a map is given as the 'phases' of the
+results (and of the Mapper, for the last map), in seconds. The phases are:
+'modularize' and 'pickleargs' (writing the func and args), 'command' (finding
+the programs and building the command), 'launch' (starting the processes),
+'startup' (from the launch until rank 0 has imported pyina), 'load' (reading
+the func and args), 'compute' (the map, without writing the results), 'dump'
+(writing the results), 'wait' (from rank 0 finishing until the results have
+been read), and 'cleanup' (removing the files). The 'total' is the sum of the
+phases, and the 'overhead' is the total other than the compute. If the
+overhead is large compared to the compute, the map is too small to launch.
+
 Additional keyword arguments are passed to 'func' along with 'args'.
         """
+        if self.persistent and self.scheduler:
+            raise ValueError("a persistent pool can not be used with a scheduler")
+        where = self._where(func, args)
+        if where is not None: # don't launch the map
+            return self._local(where, func, args)
+        cost = None # learn the cost of the map, if fallback
+        if self.fallback is True and args and hasattr(args[0], '__len__'):
+            cost = (_costkey(func), len(args[0]))
         # set strategy
         if self.scatter:
             kwds['onall'] = kwds.get('onall', True)
+            if callable(kwds.get('weights', None)): # so ranks don't need all args
+                kwds['weights'] = list(map(kwds['weights'], *args))
         else:
             kwds['onall'] = kwds.get('onall', True) #XXX: has pickling issues
-        config = {}
-        config['program'] = which_strategy(self.scatter, lazy=True)
+            kwds['chunksize'] = kwds.get('chunksize', None)
+            kwds['schedule'] = kwds.get('schedule', None)
+            kwds['prefetch'] = kwds.get('prefetch', None)
+        if self.serializer is not None: # used by the mpi world for the results
+            kwds['serializer'] = self.serializer
+        if self.compression: # used by the mpi world for the results file
+            kwds['compression'] = self.compression
+        if self.hierarchical: # one task per node, each with a local pool
+            tasks, kwds['ppn'] = self._hierarchy()
+        trace = kwds.pop('trace', None)
+        if self.timing or trace: # the mpi world writes the stats beside the results
+            kwds['stats'] = True
+        phases = OrderedDict() # the time spent in each phase of the map
+        clock = [time()]
+        def phase(name): # record the time since the last phase
+            now = time(); phases[name] = now - clock[0]; clock[0] = now
 
         # serialize function and arguments to files
         modfile = self._modularize(func)
-        argfile = self._pickleargs(args, kwds)
+        phase('modularize')
+        # get a named pipe, so the results can be read as soon as written
+        signal = open_signal()
+        if signal[1] is not None: kwds['signal'] = signal[1] # for the writer
+        try:
+            argfile = self._pickleargs(args, kwds)
+        except:
+            close_signal(*signal)
+            raise
+        phase('pickleargs')
         # Keep the above handles as long as you want the tempfiles to exist
         if _SAVE[0]:
             _HOLD.append(modfile)
@@ -270,9 +650,19 @@ Additional keyword arguments are passed to 'func' along with 'args'.
         resfilename = tempfile.mktemp(dir=self.workdir)
         # process the module name
         modname = self._modulenamemangle(modfile.name)
+        config = {}
+        if self.persistent:
+            config['program'] = which_server(lazy=True)
+        else:
+            config['program'] = which_strategy(self.scatter, lazy=True)
+        if self.hierarchical: config['nodes'] = tasks
         # build the launcher's argument string
-        config['progargs'] = ' '.join([modname, argfile.name, \
-                                       resfilename, self.workdir])
+        if self.persistent: # the arguments are sent with each request
+            config['progargs'] = ''
+            strategy = 'ezscatter' if self.scatter else 'ezpool'
+        else:
+            config['progargs'] = ' '.join([modname, argfile.name, \
+                                           resfilename, self.workdir])
 
         #XXX: better with or w/o scheduler baked into command ?
         #XXX: better... if self.scheduler: self.scheduler.submit(command) ?
@@ -285,35 +675,32 @@ Additional keyword arguments are passed to 'func' along with 'args'.
         # build the launcher command
         command = self._launcher(config)
         log.info('(skipping): %s' % command)
+        files = (modfile, argfile, resfilename)
+        phase('command')
         if log.level == logging.DEBUG:
-            error = False
-            res = []
-        else:
-            try:
-                subproc = self.__launch(command) # sumbit the jobs
-                #print "after __launch"
-               #pid = subproc.pid                # get process id
-                error = subproc.wait()           # block until all done
-                ## just to be sure... here's a loop to wait for results file ##
-                maxcount = self.timeout; counter = 0
-                #print "before wait"
-                while not os.path.exists(resfilename):
-                    call('sync', shell=True)
-                    from time import sleep
-                    sleep(1); counter += 1
-                    if counter >= maxcount:
-                        print("Warning: exceeded timeout (%s s)" % maxcount)
-                        break
-                #print "after wait"
-                # read result back
-                res = dill.load(open(resfilename,'rb'))
-                #print "got result"
-            except:
-                error = True
-                #print "got error"
+            return MapResult(self, None, command, *files, signal=signal,
+                             trace=trace, phases=phases, cost=cost)
+        try:
+            if self.persistent: # send the request to the running world
+                process = self._serve(command)
+                self._request(process, strategy, modname, argfile.name, \
+                              resfilename, self.workdir)
+            else:
+                process = self.__launch(command) # sumbit the jobs
+        except:
+            close_signal(*signal)
+            self._release(*files)
+            raise IOError("launch failed: %s" % command)
+        phase('launch')
+        return MapResult(self, process, command, *files, signal=signal,
+                         trace=trace, phases=phases, cost=cost)
         ######################################################################
-
-        # cleanup files
+    def _release(self, modfile, argfile, resfilename):
+        """clean-up the tempfiles for a map
+    - handle to pickled function source (e.g. 'my_func.py or 'my_func.pik')
+    - handle to pickled function inputs (e.g. 'my_args.arg')
+    - path to pickled function output (e.g. 'my_results')
+        """
         if _SAVE[0]:
             if log.level == logging.WARN:
                 self._save_out(resfilename) # pickled output
@@ -323,21 +710,27 @@ Additional keyword arguments are passed to 'func' along with 'args'.
             if argfile in _HOLD: _HOLD.remove(argfile)
         self._cleanup(resfilename, modfile.name, argfile.name)
         if self.scheduler and not _SAVE[0]: self.scheduler._cleanup()
-        if error:
-            raise IOError("launch failed: %s" % command)
-        return res
-   #def imap(self, func, *args, **kwds):
-   #    """'non-blocking' and 'ordered'
-   #    """
-   #    return
-   #def uimap(self, func, *args, **kwds):
-   #    """'non-blocking' and 'unordered'
-   #    """
-   #    return
-   #def amap(self, func, *args, **kwds):
-   #    """'asynchronous' map(); use "get()" to retrieve results
-   #    """
-   #    return
+        return
+    def map(self, func, *args, **kwds):
+        return self.amap(func, *args, **kwds).get()
+    map.__doc__ = amap.__doc__
+    amap.__doc__ = """
+'asynchronous' map(); use "get()" to retrieve results
+""" + map.__doc__
+    def imap(self, func, *args, **kwds):
+        """'non-blocking' and 'ordered'
+
+returns an iterator of results, where the map is launched immediately and
+blocks only until the next result is ready (see map for details).
+        """
+        return _iterate(self.amap(func, *args, **kwds), ordered=True)
+    def uimap(self, func, *args, **kwds):
+        """'non-blocking' and 'unordered'
+
+returns an iterator of results, where the map is launched immediately and
+blocks only until the next result is ready (see map for details).
+        """
+        return _iterate(self.amap(func, *args, **kwds), ordered=False)
     def __repr__(self):
         if self.scheduler:
             scheduler = self.scheduler.__class__.__name__
@@ -350,4 +743,252 @@ Additional keyword arguments are passed to 'func' along with 'args'.
     pass
 
 
+class MapResult(object):
+    """
+handle for the results of a map launched by a Mapper (see Mapper.amap)
+    """
+    def __init__(self, mapper, process, command, modfile, argfile, resfilename,
+                 signal=None, trace=None, phases=None, cost=None):
+        """
+mapper: the Mapper that launched the map
+process: the launched process (or the server for a persistent mpi world)
+command: the launch command
+modfile: handle to pickled function source
+argfile: handle to pickled function inputs
+resfilename: path to pickled function output
+signal: tuple of (file descriptor, path) of a named pipe (see open_signal)
+trace: path to write a timeline of the map (see pyina.tools.dump_trace)
+phases: dict of the time spent in each phase of the launch (see Mapper.amap)
+cost: tuple of (name of the function, number of items), to learn the cost
+        """
+        self._mapper = mapper
+        self._process = process
+        self._command = command
+        self._files = (modfile, argfile, resfilename)
+        self._signal = None if signal is None else signal[0]
+        self._trace = trace
+        self._cost = cost
+        self.phases = OrderedDict() if phases is None else phases
+        self._persistent = mapper.persistent
+        self._scheduled = bool(mapper.scheduler)
+        self._start = time()
+        self._value = []
+        self._success = None
+        self.stats = None
+        # clean up when the results are read, or when the results are deleted
+        self._finalizer = weakref.finalize(self, _finalize, mapper, process, \
+                                           self._files, *(signal or ()))
+        if process is None: # nothing was launched
+            self._finalizer()
+            self._success = True
+        return
+    def __alive(self):
+        """True if the launched process may still write results"""
+        if self._process.poll() is None: return True
+        if self._persistent or not self._scheduled: return False
+        # the scheduler returns after submitting, so wait up to the timeout
+        return time() - self._start < self._mapper.timeout
+    def ready(self):
+        """True if the map has finished"""
+        if self._success is not None: return True
+        return results_ready(self._files[-1]) or not self.__alive()
+    def successful(self):
+        """True if the map finished without error"""
+        if not self.ready():
+            raise ValueError("%r not ready" % self)
+        try: self.get()
+        except IOError: pass
+        return self._success
+    def wait(self, timeout=None):
+        """wait until the map has finished, or for timeout seconds"""
+        start = time(); delay = 1e-4
+        signal = self._signal
+        while not self.ready():
+            pause = delay
+            if timeout is not None:
+                pause = min(pause, start + timeout - time())
+                if pause <= 0: break
+            if not wait_signal(signal, pause): # the writer has closed
+                signal = None
+            delay = min(2*delay, 0.1)
+        return
+    def get(self, timeout=None):
+        """get the results of the map, waiting up to timeout seconds"""
+        self.wait(timeout)
+        if not self.ready():
+            raise TimeoutError("map results not ready within %s s" % timeout)
+        if self._success is None:
+            results = []
+            try:
+                for begin, chunk in self._stream():
+                    end = begin + len(chunk)
+                    if len(results) < end:
+                        results.extend([''] * (end - len(results)))
+                    results[begin:end] = chunk
+            except IOError:
+                pass
+            self._value = results
+        if not self._success:
+            raise IOError("launch failed: %s" % self._command)
+        return self._value
+    def _stream(self, ordered=False):
+        """iterate over the (begin, results) records as they are written
+
+if ordered=True, hold the records so they are yielded in order of begin
+
+NOTE: the tempfiles are cleaned up when the results have all been read, or
+IOError is raised if the map fails. This can only be done once per map."""
+        if self._process is None: # nothing was launched
+            return
+        if self._success is not None:
+            raise ValueError("%r has already been read" % self)
+        mapper = self._mapper
+        resfilename = self._files[-1]
+        records = iload_results(resfilename, self.__alive, self._signal, \
+                                mapper.serializer)
+        if ordered: records = _ordered(records)
+        try:
+            for record in records:
+                yield record
+            if self._persistent: # read the server's output for this map
+                mapper._response(self._process, resfilename)
+            elif self._process.wait(): # block until all done
+                raise IOError("launch failed: %s" % self._command)
+        except:
+            self._success = False
+            raise
+        else:
+            self._success = True
+            stats = load_stats(resfilename) or {}
+            self.phases.update(_phases(stats, self._start, time()))
+            self.stats = mapper.stats = stats or None
+            if self._trace and self.stats:
+                dump_trace(self._trace, self.stats)
+        finally:
+            self._signal = None
+            start = time()
+            self._finalizer() # close the pipe, and remove the files
+            self.phases['cleanup'] = time() - start
+            self.phases['total'] = sum(self.phases.values())
+            if 'compute' in self.phases: # the time spent other than computing
+                self.phases['overhead'] = \
+                    self.phases['total'] - self.phases['compute']
+            mapper.phases = self.phases
+            if self._success and self._cost and 'overhead' in self.phases:
+                key, nitems = self._cost
+                mapper._learn(key, mapper._launchname(), nitems, mapper._size(),
+                              self.phases['total'], self.phases['overhead'])
+        return
+    def __repr__(self):
+        state = 'ready' if self.ready() else 'running'
+        return "<%s(%s) for %s>" % (self.__class__.__name__, state, self._mapper)
+
+
+def _finalize(mapper, process, files, signal=None, signalname=None):
+    """clean up the files of a map, even if the results are never read
+
+mapper: the Mapper that launched the map
+process: the launched process (or the server for a persistent mpi world)
+files: tuple of (modfile, argfile, resfilename) for the map
+signal: file descriptor of the named pipe for the results (see open_signal)
+signalname: path to the named pipe for the results
+
+NOTE: if the results are not read, a launched process is terminated, while
+the files of a request to a persistent mpi world are released when the server
+is done with the request (see Mapper._response and Mapper.join)."""
+    resfilename = files[-1]
+    close_signal(signal, signalname)
+    if mapper.persistent and mapper._pending.get(resfilename) is False:
+        mapper._pending[resfilename] = files # the server may still read them
+        return
+    mapper._pending.pop(resfilename, None)
+    if not mapper.persistent and process is not None and process.poll() is None:
+        process.terminate() # the results will never be read
+        process.wait()
+    mapper._release(*files)
+    return
+
+class _LocalResult(object):
+    """
+handle for the results of a map that was not launched (see Mapper.amap)
+    """
+    def __init__(self, mapper, result, start):
+        """
+mapper: the Mapper that ran the map
+result: list of results, or the results object of a local process pool
+start: time when the map was started
+        """
+        self._mapper = mapper
+        self._result = result
+        self._start = start
+        self.stats = mapper.stats = None
+        self.phases = OrderedDict()
+        if isinstance(result, list): self._done()
+        return
+    def _done(self):
+        """record the time of the map, when the map has finished"""
+        self.phases['total'] = time() - self._start
+        self._mapper.phases = self.phases
+        return
+    def ready(self):
+        """True if the map has finished"""
+        if isinstance(self._result, list): return True
+        return self._result.ready()
+    def successful(self):
+        """True if the map finished without error"""
+        if isinstance(self._result, list): return True
+        return self._result.successful()
+    def wait(self, timeout=None):
+        """wait until the map has finished, or for timeout seconds"""
+        if isinstance(self._result, list): return
+        self._result.wait(timeout)
+        return
+    def get(self, timeout=None):
+        """get the results of the map, waiting up to timeout seconds"""
+        if isinstance(self._result, list): return self._result
+        return self._result.get(timeout)
+    def _stream(self, ordered=False):
+        """iterate over the (begin, results) records (see MapResult._stream)"""
+        yield 0, self.get()
+        return
+    def __repr__(self):
+        state = 'ready' if self.ready() else 'running'
+        return "<%s(%s) for %s>" % (self.__class__.__name__, state, self._mapper)
+
+def _phases(stats, launched, done):
+    """get the time spent in each phase of a map in the mpi world
+
+stats: dict of stats written by rank 0 (the phases are removed from stats)
+launched: time when the launch returned
+done: time when all the results had been read
+
+NOTE: the times are from the clock on rank 0, thus startup and wait are only
+accurate if rank 0 shares a clock with the mapper (e.g. without a scheduler)"""
+    phases, world = stats.pop('phases', None), stats.pop('world', None)
+    if phases is None or world is None: return {}
+    dump = phases.get('dump', 0.)
+    return OrderedDict([('startup', world[0] - launched),
+                        ('load', phases.get('load', 0.)),
+                        ('compute', phases.get('map', 0.) - dump),
+                        ('dump', dump), ('wait', done - world[1])])
+
+def _ordered(records):
+    """reorder the (begin, results) records, so the results are contiguous"""
+    held = {}; index = 0
+    for begin, results in records:
+        held[begin] = results
+        while index in held: # yield the records that are next in line
+            results = held.pop(index)
+            yield index, results
+            index += len(results)
+    return
+
+def _iterate(result, ordered=True):
+    """iterate over the results of a map, as they are written"""
+    for begin, results in result._stream(ordered):
+        for item in results:
+            yield item
+    return
+
+
 # EOF
@@ -7,13 +7,10 @@
 #  - https://github.com/uqfoundation/pyina/blob/master/LICENSE
 
 from mpi4py import MPI as mpi
-import dill
-try:
-    getattr(mpi,'pickle',getattr(mpi,'_p_pickle',None)).dumps = dill.dumps
-    getattr(mpi,'pickle',getattr(mpi,'_p_pickle',None)).loads = dill.loads
-except AttributeError:
-    pass
-from pyina.tools import lookup
+from pyina.tools import lookup, as_buffer, fanout, fanin, Recorder
+from time import time
+import numpy as np
+from collections import deque
 from pathos.helpers import ProcessPool as MPool
 master = 0
 comm = mpi.COMM_WORLD
@@ -22,6 +19,8 @@ rank = comm.Get_rank()
 any_source = mpi.ANY_SOURCE
 any_tag = mpi.ANY_TAG
 EXITTAG = 0
+MINWAIT = 1e-5 # shortest wait on the master's job, between polls for workers
+MAXWAIT = 1e-3 # longest wait on the master's job, between polls for workers
 __SKIP = [True]
 import logging
 log = logging.getLogger("mpi_pool")
@@ -41,98 +40,334 @@ def __index(*inputs):
     NJOBS = len(inputs[0])
     return iter(range(NJOBS))
 
+SCHEDULES = ('static', 'dynamic', 'guided', 'adaptive')
+
+class ChunkScheduler(object):
+    """chunk scheduler for the worker pool strategy
+
+njobs: int number of jobs
+workers: list of int ranks of the nodes that calculate
+chunksize: int number of jobs in a chunk (the minimum, if guided or adaptive)
+schedule: str policy used to size the chunks (one of SCHEDULES)
+
+The schedules follow the OpenMP loop schedules:
+    - static: chunks are assigned to the workers round-robin, in advance
+    - dynamic: chunks of a fixed size are handed out as workers free up
+    - guided: chunk sizes shrink in proportion to the remaining jobs
+    - adaptive: chunk sizes are scaled by each worker's measured throughput
+    """
+    def __init__(self, njobs, workers, chunksize=None, schedule=None):
+        if schedule is None: schedule = 'dynamic'
+        if schedule not in SCHEDULES:
+            raise ValueError("schedule must be one of %s" % (SCHEDULES,))
+        self.njobs = njobs
+        self.workers = list(workers)
+        self.schedule = schedule
+        nworkers = len(self.workers) or 1
+        if not chunksize:
+            if schedule == 'static': # a single chunk for each worker
+                chunksize = -(-njobs // nworkers)
+            elif schedule == 'dynamic': # roughly four chunks for each worker
+                chunksize = -(-njobs // (4 * nworkers))
+            else: # the minimum chunk size
+                chunksize = 1
+        self.chunksize = max(int(chunksize), 1)
+        self.begin = 0  # first index not yet scheduled
+        self.sent = {}  # times the outstanding chunks were sent, per worker
+        self.last = {}  # time the last chunk was completed, for each worker
+        self.rate = {}  # measured jobs per second, for each worker
+        if schedule == 'static':
+            chunks = range(0, njobs, self.chunksize)
+            chunks = [(i, min(i+self.chunksize, njobs)) for i in chunks]
+            self.queue = dict((w, iter(chunks[i::nworkers])) for (i,w) \
+                                                   in enumerate(self.workers))
+        return
+    def __size(self, worker):
+        """get the number of jobs in the next chunk for the given worker"""
+        remaining = self.njobs - self.begin
+        nworkers = len(self.workers) or 1
+        if self.schedule == 'guided':
+            size = -(-remaining // nworkers)
+        elif self.schedule == 'adaptive': # i.e. weighted factoring
+            if self.rate:
+                mean = sum(self.rate.values()) / len(self.rate)
+                total = sum(self.rate.get(w, mean) for w in self.workers)
+                share = self.rate.get(worker, mean) / total
+            else:
+                share = 1. / nworkers
+            size = int(-(-remaining * share // 2))
+        else:
+            size = self.chunksize
+        return min(max(size, self.chunksize), remaining)
+    def next(self, worker):
+        """get the (begin, end) index of the next chunk for the given worker
+
+returns None when there are no jobs remaining for the worker"""
+        if self.schedule == 'static':
+            chunk = next(self.queue.get(worker, iter(())), None)
+        elif self.begin < self.njobs:
+            size = self.__size(worker)
+            chunk = (self.begin, self.begin + size)
+            self.begin += size
+        else:
+            chunk = None
+        if chunk is not None:
+            self.sent.setdefault(worker, deque()).append(mpi.Wtime())
+        return chunk
+    def done(self, worker, chunk):
+        """record the completion of the given chunk by the given worker
+
+chunks are expected to complete in the order they were sent to the worker"""
+        now = mpi.Wtime()
+        sent = self.sent.get(worker)
+        start = sent.popleft() if sent else now
+        # a prefetched chunk starts when the worker finishes the previous one
+        elapsed = now - max(start, self.last.get(worker, start))
+        self.last[worker] = now
+        if elapsed <= 0: return
+        rate = (chunk[1] - chunk[0]) / elapsed
+        if worker in self.rate: # smooth out the noise in the measurement
+            rate = 0.5 * (rate + self.rate[worker])
+        self.rate[worker] = rate
+        return
+
+def __send(results, dest, tag):
+    """send the list of results, as a raw buffer if they are uniform ndarrays"""
+    buffer = as_buffer(results)
+    if buffer is None: # send the pickled list
+        comm.send(results, dest, tag)
+        return
+    # send a (shape, dtype) header, then the buffer itself
+    comm.send((buffer.shape, buffer.dtype), dest, tag)
+    comm.Send(buffer, dest, tag)
+    return
+
+def __recv_buffer(source, tag, shape, dtype):
+    """receive an ndarray buffer, returning the list of results it holds"""
+    buffer = np.empty(shape, dtype)
+    comm.Recv(buffer, source, tag)
+    return list(buffer), buffer.nbytes
+
+def __report(recorder, stats, **info):
+    """gather the timing records from all nodes, and pass the stats to stats"""
+    if not recorder.enabled: return
+    merged = recorder.gather(comm, master, **info)
+    if merged is not None and callable(stats): stats(merged)
+    return
+
 def parallel_map(func, *seq, **kwds):
-    """the worker pool strategy for mpi"""
+    """the worker pool strategy for mpi
+
+Optional Keyword Arguments:
+    - onall  = if True, include master as a worker       [default: True]
+    - chunksize  = number of jobs sent to a worker at a time  [default: None]
+    - schedule  = policy for sizing the chunks            [default: 'dynamic']
+    - prefetch  = number of chunks queued on each worker  [default: 1]
+    - callback  = function called as results are received [default: None]
+    - stats  = if True, record the time spent on each task [default: False]
+    - ppn  = number of processes in the local pool of each node [default: 1]
+
+NOTE: each chunk is a contiguous range of indices, and the worker returns the
+results for the entire chunk in a single message. The schedule is one of
+'static', 'dynamic', 'guided', or 'adaptive' (see ChunkScheduler).
+If chunksize is not given, 'static' sends a single chunk to each worker, and
+'dynamic' splits the jobs into roughly four chunks for each worker. For the
+'guided' and 'adaptive' schedules, chunksize is the minimum size of a chunk.
+
+NOTE: with prefetch > 1, the master keeps up to 'prefetch' chunks outstanding
+on each worker, so a worker can start the next chunk as soon as it finishes
+the current one, instead of waiting on the master for a reply.
+
+NOTE: if callback is given, the master calls callback(begin, results) as each
+chunk of results is received, where begin is the index of results[0]. The
+results are then not kept by the master (thus a list of '' is returned).
+
+NOTE: if stats is given, each node records the time spent on each task, and
+on each message (see pyina.tools.Recorder), and the records are gathered on
+the master. If stats is a function, the master calls stats(merged), where
+merged is the dict of aggregated stats (see pyina.tools.merge_stats). If stats
+is a Recorder, it is used to record the map (and holds the merged stats).
+
+NOTE: if ppn > 1, each node splits each chunk it receives into ppn pieces,
+which are evaluated on a local pool of ppn processes. With one node launched
+per host, the master then receives a message for ppn times as many jobs.
+    """
     skip = not bool(kwds.get('onall', True))
     __SKIP[0] = skip
 
     NJOBS = len(seq[0])
     nodes = size if size <= NJOBS+skip else NJOBS+skip # nodes <= NJOBS+(master)
-   #queue = __queue(*seq) #XXX: passing the *data*
-    queue = __index(*seq) #XXX: passing the *index*
+    workers = range(int(skip), nodes) # the ranks that calculate
+    chunksize = kwds.get('chunksize', None)
+    schedule = ChunkScheduler(NJOBS, workers, chunksize, kwds.get('schedule'))
+    prefetch = max(int(kwds.get('prefetch', None) or 1), 1)
+    ppn = max(int(kwds.get('ppn', None) or 1), 1)
+    callback = kwds.get('callback', None)
+    stats = kwds.get('stats', None)
+    if isinstance(stats, Recorder): recorder = stats # already recording
+    else: recorder = Recorder(rank, bool(stats))
+    info = dict(strategy='mpi_pool', size=size, njobs=NJOBS)
     results = [''] * NJOBS
+    def store(ib, ie, message): # handle the results[ib:ie] on the master
+        if callback is None: results[ib:ie] = message
+        else: callback(ib, message)
+    def submit(chunk, pool): # start a chunk of jobs on a local pool
+        input = lookup(seq, *chunk) #XXX: receives an *index*
+        return fanout(pool, ppn, func, chunk[0], *input, timed=recorder.enabled)
+    def collect(pieces): # join the pieces of a chunk, and record the tasks
+        message, tasks = fanin(pieces)
+        recorder.tasks.extend(tasks)
+        return message
 
     if rank == master:
         log.info("size: %s, NJOBS: %s, nodes: %s, skip: %s" % (size, NJOBS, nodes, skip))
-        if nodes == 1: # the pool is just the master
+        log.info("schedule: %s, chunksize: %s, prefetch: %s" % (schedule.schedule, schedule.chunksize, prefetch))
+        if nodes <= 1: # the pool is just the master
             if skip: raise ValueError("There must be at least one worker node")
-            return map(func, *seq)
+            if ppn > 1: # fan out to the local pool
+                pool = MPool(ppn)
+                store(0, NJOBS, collect(submit((0, NJOBS), pool).get()))
+                pool.close()
+                pool.join()
+            else:
+                store(0, NJOBS, recorder.map(func, 0, *seq))
+            comm.barrier() # any unused nodes are waiting at the barrier
+            __report(recorder, stats, **info)
+            return results
         # spawn a separate process for jobs running on the master
+        mchunk = None
         if not skip:
-            pool = MPool(1) #XXX: poor pickling... use iSend/iRecv instead?
-           #input = queue.next() #XXX: receiving the *data*
-            input = lookup(seq, next(queue)) #XXX: receives an *index*
-            log.info("MASTER SEND'ING(0)")
-            mresult, mjobid = pool.apply_async(func, args=input), 0
+            pool = MPool(ppn) #XXX: poor pickling...
+            mchunk = schedule.next(master)
+        if mchunk is not None:
+            log.info("MASTER SEND'ING(%s:%s)" % mchunk)
+            mresult = submit(mchunk, pool)
         # farm out to workers: 1-N for indexing, 0 reserved for termination
+        donejob = 0
+        chunks = {} # the outstanding chunks on each worker
+        sends = [] # the outstanding send requests
         for worker in range(1, nodes): #XXX: don't run on master...
-            # master send next job to worker 'worker' with tag='worker'
-            log.info("WORKER SEND'ING(%s)" % (worker-skip,))
-            comm.send(next(queue), worker, worker)
+            chunks[worker] = deque()
+            for depth in range(prefetch):
+                chunk = schedule.next(worker)
+                if chunk is None: break
+                # master send next chunk to worker 'worker' with tag='begin+1'
+                log.info("WORKER SEND'ING(%s:%s)" % chunk)
+                sends.append(comm.isend(chunk, worker, chunk[0]+1))
+                chunks[worker].append(chunk)
+            if not chunks[worker]: # there's no work for this worker
+                log.info("WORKER SEND'ING(DONE)")
+                sends.append(comm.isend("done", worker, EXITTAG))
+                donejob += 1
 
-        # start receiving
-        recvjob = 0; donejob = 0
-        sendjob = nodes
+        # start the event loop: service the workers and the master's own job
+        recvjob = 0
+        delay = 0 # time to wait on the master's job before polling again
         while recvjob < NJOBS:  # was: for job in range(NJOBS)
-            log.info("--job(%s,%s)--" % (sendjob-skip, recvjob))
-            if recvjob < NJOBS and donejob < nodes-1:
-                status = mpi.Status()
-                # master receive jobs from any_source and any_tag
+            log.info("--job(%s)--" % recvjob)
+            status = mpi.Status()
+            start = time()
+            if mchunk is None: # only the workers are busy, so block on them
                 log.info("RECV'ING FROM WORKER")
-                message = comm.recv(source=any_source,tag=any_tag,status=status)
+                received = comm.mprobe(source=any_source, tag=any_tag,
+                                       status=status)
+                recorder.wait('probe', start)
+            else: # don't keep the master's job waiting behind the workers
+                received = comm.improbe(source=any_source, tag=any_tag,
+                                        status=status)
+            if received is not None:
+                # master receive jobs from any_source and any_tag
+                start = time()
+                nbytes = status.Get_count(mpi.BYTE)
+                message = received.recv()
                 sender = status.source
                 anstag = status.tag
-                if anstag: recvjob += 1  # don't count a 'donejob'
-                results[anstag-skip] = message # store the received message
-                log.info("WORKER(%s): %s" % (anstag-skip, message))
-                if (sendjob-skip < NJOBS): # then workers are not done
-                    # master send next job to worker 'sender' with tag='jobid'
-                    log.info("WORKER SEND'ING(%s)" % (sendjob-skip))
-                    input = next(queue)
-                    comm.send(input, sender, sendjob)
-                    sendjob += 1
-                else: # workers are done
+                if isinstance(message, tuple): # header for an ndarray buffer
+                    message, count = __recv_buffer(sender, anstag, *message)
+                    nbytes += count
+                recorder.message('recv', sender, nbytes, start)
+                start = time()
+                # chunks are returned in the order they were sent
+                ib, ie = chunk = chunks[sender].popleft()
+                schedule.done(sender, chunk)
+                recvjob += ie - ib
+                store(ib, ie, message) # store the received message
+                log.info("WORKER(%s:%s): %s" % (ib, ie, message))
+                sends = [req for req in sends if not req.Test()]
+                chunk = schedule.next(sender)
+                if chunk is not None: # then workers are not done
+                    # master send next chunk to worker 'sender' with tag='begin+1'
+                    log.info("WORKER SEND'ING(%s:%s)" % chunk)
+                    sends.append(comm.isend(chunk, sender, chunk[0]+1))
+                    chunks[sender].append(chunk)
+                elif not chunks[sender]: # workers are done
                     # send the "exit" signal
                     log.info("WORKER SEND'ING(DONE)")
-                    comm.send("done", sender, EXITTAG)
+                    sends.append(comm.isend("done", sender, EXITTAG))
                     donejob += 1
-            log.info("WORKER LOOP DONE")
+                recorder.wait('dispatch', start) # from recv to the next send
+                delay = 0
+            if mchunk is None:
+                continue
             # check if the master is done
-            log.info("--job(%s,%s)--" % (sendjob-skip, recvjob))
-            if not skip and mresult.ready():
+            if received is None and not mresult.ready():
+                # wait for the master, with backoff while the workers are idle
+                start = time()
+                mresult.wait(delay)
+                recorder.wait('poll', start)
+                delay = min(2*delay or MINWAIT, MAXWAIT)
+            if mresult.ready():
                 log.info("RECV'ING FROM MASTER")
-                results[mjobid] = mresult.get()
-                log.info("MASTER(%s): %s" % (mjobid, results[mjobid]))
-                recvjob += 1
-                if (sendjob < NJOBS):
-                    log.info("MASTER SEND'ING(%s)" % sendjob)
-                   #input = queue.next() #XXX: receiving the *data*
-                    input = lookup(seq, next(queue)) #XXX: receives an *index*
-                    mresult, mjobid = pool.apply_async(func, args=input),sendjob
-                    sendjob += 1
-                else: mresult.ready = lambda : False
-            log.info("MASTER LOOP DONE")
+                ib, ie = mchunk
+                schedule.done(master, mchunk)
+                message = collect(mresult.get())
+                store(ib, ie, message)
+                log.info("MASTER(%s:%s): %s" % (ib, ie, message))
+                recvjob += ie - ib
+                mchunk = schedule.next(master)
+                if mchunk is not None:
+                    log.info("MASTER SEND'ING(%s:%s)" % mchunk)
+                    mresult = submit(mchunk, pool)
+                delay = 0
         log.info("WE ARE EXITING")
+        mpi.Request.Waitall(sends)
         if not skip:
             pool.close()
             pool.join()
     elif (nodes != size) and (rank >= nodes): # then skip this node...
         pass
     else: # then this is a worker node
+        local = MPool(ppn) if ppn > 1 else None
+        # receive jobs from master @ any_tag
+        request = comm.irecv(source=master, tag=any_tag)
         while True:
-            # receive jobs from master @ any_tag
             status = mpi.Status()
-            message = comm.recv(source=master, tag=any_tag, status=status)
+            start = time()
+            message = request.wait(status=status)
+            recorder.message('recv', master, status.Get_count(mpi.BYTE), start)
             tag = status.tag
             if tag == EXITTAG: # worker is done
                 break
-            # worker evaluates received job
-           #result = func(*message) #XXX: receiving the *data*
-            result = func(*lookup(seq, message)) #XXX: receives an *index*
-            # send result back to master
-            comm.send(result, master, tag) #XXX: or write to results then merge?
+            # post the receive for the next job, so it arrives while working
+            request = comm.irecv(source=master, tag=any_tag)
+            # worker evaluates received chunk
+           #result = list(map(func, *message)) #XXX: receiving the *data*
+            if local is None:
+                result = recorder.map(func, message[0], *lookup(seq, *message)) #XXX: receives an *index*
+            else: # fan out the chunk to the local pool
+                result = collect(submit(message, local).get())
+            # send results back to master
+            start = time()
+            __send(result, master, tag) #XXX: or write to results then merge?
+            recorder.wait('send', start)
+        if local is not None:
+            local.close()
+            local.join()
 
+    start = time()
     comm.barrier()
+    recorder.wait('barrier', start)
+    __report(recorder, stats, **info)
     return results
 
 
@@ -7,13 +7,11 @@
 #  - https://github.com/uqfoundation/pyina/blob/master/LICENSE
 
 from mpi4py import MPI as mpi
-import dill
-try:
-    getattr(mpi,'pickle',getattr(mpi,'_p_pickle',None)).dumps = dill.dumps
-    getattr(mpi,'pickle',getattr(mpi,'_p_pickle',None)).loads = dill.loads
-except AttributeError:
-    pass
-from pyina.tools import get_workload, balance_workload, lookup
+from pyina.tools import get_workload, balance_workload, lookup, as_buffer
+from pyina.tools import Recorder, fanout, fanin
+from pathos.helpers import ProcessPool as MPool
+from time import time
+import numpy as np
 master = 0
 comm = mpi.COMM_WORLD
 size = comm.Get_size()
@@ -38,8 +36,126 @@ def __index(*inputs):
    #return izip(*balance_workload(size, NJOBS, skip=__SKIP[0]))
 
 
+def __send(results, dest, tag):
+    """send the list of results, as a raw buffer if they are uniform ndarrays"""
+    buffer = as_buffer(results)
+    if buffer is None: # send the pickled list
+        comm.send(results, dest, tag)
+        return
+    # send a (shape, dtype) header, then the buffer itself
+    comm.send((buffer.shape, buffer.dtype), dest, tag)
+    comm.Send(buffer, dest, tag)
+    return
+
+def __recv_buffer(source, tag, shape, dtype):
+    """receive an ndarray buffer, returning the list of results it holds"""
+    buffer = np.empty(shape, dtype)
+    comm.Recv(buffer, source, tag)
+    return list(buffer), buffer.nbytes
+
+def __report(recorder, stats, **info):
+    """gather the timing records from all nodes, and pass the stats to stats"""
+    if not recorder.enabled: return
+    merged = recorder.gather(comm, master, **info)
+    if merged is not None and callable(stats): stats(merged)
+    return
+
+def __compute(recorder, ppn, func, begin, *inputs):
+    """evaluate func across the inputs, on a local pool if ppn > 1"""
+    if ppn <= 1 or not len(inputs[0]): return recorder.map(func, begin, *inputs)
+    pool = MPool(ppn)
+    try:
+        pieces = fanout(pool, ppn, func, begin, *inputs, timed=recorder.enabled)
+        results, tasks = fanin(pieces.get())
+    finally:
+        pool.close()
+        pool.join()
+    recorder.tasks.extend(tasks)
+    return results
+
+def __workload(njobs, skip=None, weights=None):
+    """get a function that returns the (begin, end) index for a given rank
+
+njobs: int number of jobs
+skip: int rank of node upon which to not calculate (i.e. the master)
+weights: list of float cost of each job (i.e. len(weights) == njobs)
+    """
+    if weights is None:
+        return lambda index: get_workload(index, size, njobs, skip=skip)
+    bounds = list(zip(*balance_workload(size, njobs, skip=skip, weights=weights)))
+    return bounds.__getitem__
+
+def __gather(result, njobs, workload):
+    """gather the results from all nodes to the master, using collectives
+
+result: list of results calculated on this node
+njobs: int number of jobs
+workload: function that returns the (begin, end) index for a given rank
+
+returns the list of all results on the master, and None on the workers"""
+    buffer = as_buffer(result)
+    header = None if buffer is None else (buffer.shape[1:], buffer.dtype)
+    # all nodes must agree on the (shape, dtype) of a non-empty result
+    headers = comm.allgather(header if len(result) else False)
+    headers = set(h for h in headers if h is not False)
+    if len(headers) == 1 and None not in headers:
+        shape, dtype = headers.pop()
+        nbytes = dtype.itemsize * int(np.prod(shape))
+    else:
+        nbytes = 0
+    if not nbytes: # gather the pickled lists
+        results = comm.gather(result, root=master)
+        if rank != master: return None
+        return [i for part in results for i in part]
+    # gather the buffers, where each 'row' of the buffer is a single result
+    if buffer is None: buffer = np.empty((0,)+shape, dtype)
+    row = mpi.BYTE.Create_contiguous(nbytes)
+    row.Commit()
+    if rank == master:
+        results = np.empty((njobs,)+shape, dtype)
+        bounds = [workload(i) for i in range(size)]
+        counts = [ie - ib for (ib, ie) in bounds]
+        displs = [ib for (ib, ie) in bounds]
+        comm.Gatherv([buffer, len(buffer), row], [results, counts, displs, row], root=master)
+    else:
+        comm.Gatherv([buffer, len(buffer), row], None, root=master)
+    row.Free()
+    return list(results) if rank == master else None
+
+
 def parallel_map(func, *seq, **kwds):
-    """the scatter-gather strategy for mpi"""
+    """the scatter-gather strategy for mpi
+
+Optional Keyword Arguments:
+    - onall  = if True, include master as a worker       [default: True]
+    - collective  = if True, gather with MPI collectives  [default: True]
+    - weights  = cost of each job, or a function of the job's arguments
+    - callback  = function called as results are received [default: None]
+    - stats  = if True, record the time spent on each task [default: False]
+    - ppn  = number of processes in the local pool of each node [default: 1]
+
+NOTE: with collective=True, each node calculates its own workload, and the
+results are collected with a single (tree-based) gather, instead of with a
+message from each worker to the master. Results that are ndarrays of uniform
+dtype and shape are gathered directly from their buffers (with Gatherv).
+
+NOTE: if weights are given, the jobs are split into contiguous partitions of
+near-equal total cost, instead of near-equal number of jobs. If weights is a
+function, it is called as weights(*args) for each set of arguments to func.
+
+NOTE: if callback is given, the master calls callback(begin, results) as each
+set of results is received, where begin is the index of results[0]. The
+results are then not kept by the master (thus a list of '' is returned).
+
+NOTE: if stats is given, each node records the time spent on each task, and
+on each message (see pyina.tools.Recorder), and the records are gathered on
+the master. If stats is a function, the master calls stats(merged), where
+merged is the dict of aggregated stats (see pyina.tools.merge_stats). If stats
+is a Recorder, it is used to record the map (and holds the merged stats).
+
+NOTE: if ppn > 1, each node splits its jobs into ppn pieces, which are
+evaluated on a local pool of ppn processes.
+    """
     skip = not bool(kwds.get('onall', True))
     if skip is False: skip = None
     else:
@@ -49,8 +165,31 @@ def parallel_map(func, *seq, **kwds):
     __SKIP[0] = skip
 
     NJOBS = len(seq[0])
+    weights = kwds.get('weights', None)
+    if callable(weights): # get the cost of each job
+        weights = list(map(weights, *seq))
+    workload = __workload(NJOBS, skip=skip, weights=weights)
+    callback = kwds.get('callback', None)
+    ppn = max(int(kwds.get('ppn', None) or 1), 1)
+    stats = kwds.get('stats', None)
+    if isinstance(stats, Recorder): recorder = stats # already recording
+    else: recorder = Recorder(rank, bool(stats))
+    info = dict(strategy='mpi_scatter', size=size, njobs=NJOBS)
+    if kwds.get('collective', True):
+        # each processor knows which jobs it has to do
+        ib, ie = workload(rank)
+        result = __compute(recorder, ppn, func, ib, *lookup(seq, ib, ie))
+        start = time()
+        results = __gather(result, NJOBS, workload)
+        recorder.wait('gather', start)
+        __report(recorder, stats, **info)
+        if results is None: return [''] * NJOBS
+        if callback is None: return results
+        callback(0, results)
+        return [''] * NJOBS
+
 #   queue = __queue(*seq) #XXX: passing the *data*
-    queue = __index(*seq) #XXX: passing the *index*
+    queue = (workload(i) for i in range(size)) #XXX: passing the *index*
     results = [''] * NJOBS
 
     if rank == master:
@@ -63,37 +202,50 @@ def parallel_map(func, *seq, **kwds):
     else:
         # worker 'rank' receiving job
         status = mpi.Status()
+        start = time()
         message = comm.recv(source=master, tag=any_tag, status=status)
+        recorder.message('recv', master, status.Get_count(mpi.BYTE), start)
         # message received; no need to parse tags
 
     # now message is the part of seq that each worker has to do
 #   result = map(func, *message) #XXX: receiving the *data*
-    result = list(map(func, *lookup(seq, *message))) #XXX: receives an *index*
+    result = __compute(recorder, ppn, func, message[0], *lookup(seq, *message)) #XXX: receives an *index*
 
     if rank == master:
-        _b, _e = get_workload(rank, size, NJOBS, skip=skip)
+        _b, _e = workload(rank)
        #_b, _e = balance_workload(size, NJOBS, rank, skip=skip)
-        results[_b:_e] = result[:]
+        if callback is None: results[_b:_e] = result[:]
+        else: callback(_b, result)
 
     # at this point, all nodes must sent to master
     if rank != master:
         # worker 'rank' sending answer to master
-        comm.send(result, master, rank)
+        start = time()
+        __send(result, master, rank)
+        recorder.wait('send', start)
     else:
         # master needs to receive once for each worker
         for worker in range(1, size):
             # master listening for worker
             status = mpi.Status()
+            start = time()
             message = comm.recv(source=any_source, tag=any_tag, status=status)
+            nbytes = status.Get_count(mpi.BYTE)
             sender = status.source
-           #anstag = status.tag
+            anstag = status.tag
+            if isinstance(message, tuple): # header for an ndarray buffer
+                message, count = __recv_buffer(sender, anstag, *message)
+                nbytes += count
+            recorder.message('recv', sender, nbytes, start)
             # master received answer from worker 'sender'
-            ib, ie = get_workload(sender, size, NJOBS, skip=skip)
+            ib, ie = workload(sender)
            #ib, ie = balance_workload(size, NJOBS, sender, skip=skip)
-            results[ib:ie] = message
+            if callback is None: results[ib:ie] = message
+            else: callback(ib, message)
             # master received results[ib:ie] from worker 'sender'
 
     #comm.barrier()
+    __report(recorder, stats, **info)
     return results
 
 
@@ -56,6 +56,7 @@ __all__ = ['Scheduler', 'Torque', 'Moab', 'Lsf', 'Sbatch', 'Scheduled']
 from pyina.mpi import defaults
 from subprocess import Popen, call
 import os, os.path
+import re
 import tempfile
 import dill as pickle
 
@@ -143,6 +144,52 @@ associated scheduler.
         call('rm -f %s' % self.errfile, shell=True)
         #print "called scheduler cleanup"
         return
+    def _jobid(self, jobfile=None):
+        """get the id of the submitted job from the jobfile (or None if unknown)"""
+        if self._jobpattern is None: return None
+        try:
+            with open(jobfile or self.jobfile) as file:
+                output = file.read()
+        except IOError:
+            return None
+        match = re.search(self._jobpattern, output)
+        return match.group(1) if match else None
+    def _state(self, jobid):
+        """get the state of the submitted job (or None if unknown)
+
+returns one of 'queued', 'running', 'done', 'failed', or None"""
+        return None
+    def _wait(self, filename, timeout=None, jobfile=None, maxwait=30):
+        """block until the submitted job has written the results file
+
+filename: path to the results file (see pyina.tools.open_results)
+timeout: float maximum number of seconds to wait [default: None]
+jobfile: path to the output of the submission [default: self.jobfile]
+maxwait: float maximum number of seconds between checks [default: 30]
+
+NOTE: the time between checks grows exponentially, up to maxwait. At each
+check, the scheduler is asked for the state of the job, so that a failed or
+cancelled job raises an IOError without waiting for the timeout."""
+        from pyina.tools import results_ready
+        from time import time, sleep
+        jobid = self._jobid(jobfile)
+        start = time(); delay = 0.1
+        finished = None # when the job was first seen to be done
+        while not results_ready(filename):
+            elapsed = time() - start
+            if timeout is not None and elapsed >= timeout:
+                raise TimeoutError("job %s exceeded timeout (%s s)" % (jobid, timeout))
+            state = self._state(jobid) if jobid else None
+            if state == 'failed':
+                raise IOError("job %s failed" % jobid)
+            if state == 'done': # allow the results file some time to land
+                if finished is None: finished = time()
+                elif time() - finished > maxwait and not results_ready(filename):
+                    raise IOError("job %s finished without results" % jobid)
+            pause = delay if timeout is None else min(delay, timeout - elapsed)
+            sleep(max(pause, 0))
+            delay = min(2*delay, maxwait)
+        return
     def fetch(self, outfile, subproc=None): #FIXME: call fetch after submit???
         """fetch result from the results file"""
         try:
@@ -202,12 +249,34 @@ equivalent to:  (command)
         return "<scheduler %s(nodes='%s', timelimit=%s, queue=%s)>" % subargs
     # interface
     settings = property(__settings) #XXX: set?
+    _jobpattern = None # how to find the job id in the jobfile
     pass
 
+def _query(command):
+    """get the output of a scheduler query (or '' if the query fails)"""
+    from subprocess import check_output, STDOUT, CalledProcessError
+    try:
+        return check_output(command, shell=True, stderr=STDOUT,
+                            universal_newlines=True)
+    except (CalledProcessError, OSError):
+        return ''
+
 class Torque(Scheduler):
     """
 Scheduler that leverages the torque scheduler.
     """
+    _jobpattern = r'^\s*(\S+)' # qsub prints the job id
+    def _state(self, jobid):
+        output = _query('qstat -f %s' % jobid)
+        match = re.search(r'job_state\s*=\s*(\w)', output)
+        if not match: return None # the job is unknown, or has been purged
+        state = match.group(1)
+        if state in 'RE': return 'running'
+        if state in 'CF': # finished
+            match = re.search(r'exit_status\s*=\s*(-?\d+)', output)
+            return 'failed' if match and int(match.group(1)) else 'done'
+        return 'queued'
+    _state.__doc__ = Scheduler._state.__doc__
     def _submit(self, command, kdict={}):
         """prepare the given command for submission with qsub
 
@@ -232,6 +301,19 @@ class Moab(Scheduler):
     """
 Scheduler that leverages the moab scheduler.
     """
+    _jobpattern = r'(\S+)\s*$' # msub prints the job id
+    def _state(self, jobid):
+        output = _query('checkjob %s' % jobid)
+        match = re.search(r'State:\s*(\w+)', output)
+        if not match: return None
+        state = match.group(1)
+        if state in ('Running', 'Starting', 'Suspended'): return 'running'
+        if state in ('Removed', 'Vacated'): return 'failed' # e.g. cancelled
+        if state == 'Completed':
+            match = re.search(r'Completion Code:\s*(-?\d+)', output)
+            return 'failed' if match and int(match.group(1)) else 'done'
+        return 'queued'
+    _state.__doc__ = Scheduler._state.__doc__
     def _submit(self, command, kdict={}):
         """prepare the given command for submission with msub
 `
@@ -256,6 +338,15 @@ class Lsf(Scheduler):
     """
 Scheduler that leverages the lsf scheduler.
     """
+    _jobpattern = r'Job <(\d+)>' # bsub prints 'Job <id> is submitted...'
+    def _state(self, jobid):
+        state = _query('bjobs -noheader -o stat %s' % jobid).strip()
+        if state in ('PEND', 'PSUSP'): return 'queued'
+        if state in ('RUN', 'USUSP', 'SSUSP'): return 'running'
+        if state == 'DONE': return 'done'
+        if state == 'EXIT': return 'failed'
+        return None
+    _state.__doc__ = Scheduler._state.__doc__
     def __init__(self, *args, **kwds):
         Scheduler.__init__(self, *args, **kwds)
         mpich = kwds.get('mpich', '') # required for mpich_gm and mpich_mx
@@ -389,6 +480,21 @@ class Sbatch(Scheduler):
     """
 Scheduler that leverages the slurm sbatch scheduler.
     """
+    _jobpattern = r'Submitted batch job (\d+)'
+    def _state(self, jobid):
+        state = _query('squeue -h -j %s -o %%T' % jobid).strip()
+        if not state or ' ' in state: # the job has left the queue (or error)
+            state = _query('sacct -n -X -P -j %s -o State' % jobid).strip()
+        state = state.split()[0] if state else '' # e.g. 'CANCELLED by 0'
+        if state in ('RUNNING', 'COMPLETING', 'SUSPENDED', 'STOPPED'):
+            return 'running'
+        if state == 'COMPLETED': return 'done'
+        if state in ('FAILED', 'CANCELLED', 'TIMEOUT', 'NODE_FAIL', 'BOOT_FAIL',
+                     'PREEMPTED', 'OUT_OF_MEMORY', 'DEADLINE', 'REVOKED'):
+            return 'failed'
+        if state: return 'queued' # e.g. 'PENDING', 'CONFIGURING', 'REQUEUED'
+        return None
+    _state.__doc__ = Scheduler._state.__doc__
     def _submit(self, command, kdict={}):
         """prepare the given command for submission with sbatch
 
@@ -58,18 +58,364 @@ def check_pool(source=False):
     res = timed_pool(pool, items, delay, verbose)
     assert res == std
 
+def check_chunksize(chunksize=None, schedule=None, prefetch=None):
+    from pyina.launchers import Pool as MPI
+    pool = MPI(4)
+    _x = range(int(-items/2), int(items/2), 2)
+    _y = range(len(_x))
+    _d = [0]*len(_x)
+    res = pool.map(busy_add, _x, _y, _d, chunksize=chunksize,
+                   schedule=schedule, prefetch=prefetch)
+    assert res == std
+
 def check_scatter(source=False):
     from pyina.launchers import Scatter as MPI
     pool = MPI(4, source=source)
     res = timed_pool(pool, items, delay, verbose)
     assert res == std
 
+def check_collective(collective=True, weights=None):
+    from pyina.launchers import Scatter as MPI
+    pool = MPI(4)
+    _x = range(int(-items/2), int(items/2), 2)
+    _y = range(len(_x))
+    _d = [0]*len(_x)
+    res = pool.map(busy_add, _x, _y, _d, collective=collective, weights=weights)
+    assert res == std
+
 
 def test_nosource():
     check_serial()
     check_pool()
     check_scatter()
 
+def test_chunksize():
+    check_chunksize(1)
+    check_chunksize(7)
+    check_chunksize(items)
+
+def test_schedule():
+    for schedule in ('static', 'dynamic', 'guided', 'adaptive'):
+        check_chunksize(None, schedule)
+        check_chunksize(3, schedule)
+        check_chunksize(3, schedule, prefetch=3)
+
+def scaled(x):
+    return 2*x
+
+def check_ndarray(scatter=False):
+    import numpy as np
+    from pyina.launchers import Pool, Scatter
+    pool = (Scatter if scatter else Pool)(4)
+    x = [np.arange(5.)*i for i in range(items)]
+    res = pool.map(scaled, x)
+    assert all(type(i) is np.ndarray for i in res)
+    assert np.array_equal(res, list(map(scaled, x)))
+    res = pool.map(np.sum, x)
+    assert np.array_equal(res, list(map(np.sum, x)))
+
+def check_persistent(scatter=False, source=False):
+    from pyina.launchers import Pool, Scatter
+    pool = (Scatter if scatter else Pool)(4, persistent=True, source=source)
+    res = timed_pool(pool, items, 0, verbose)
+    assert res == std
+    server = pool._server
+    assert server.poll() is None
+    res = pool.map(scaled, range(items))
+    assert res == list(map(scaled, range(items)))
+    assert pool._server is server
+    pool.close()
+    pool.join()
+    assert pool._server is None
+    assert server.returncode == 0
+
+def check_async(scatter=False, persistent=False):
+    from pyina.launchers import Pool, Scatter
+    pool = (Scatter if scatter else Pool)(4, persistent=persistent)
+    _x = range(int(-items/2), int(items/2), 2)
+    _y = range(len(_x))
+    _d = [0]*len(_x)
+    res = pool.amap(busy_add, _x, _y, _d)
+    _res = pool.amap(scaled, range(items))
+    assert res.get() == std
+    assert _res.get() == list(map(scaled, range(items)))
+    assert res.ready() and res.successful()
+    res = pool.imap(busy_add, _x, _y, _d)
+    assert list(res) == std
+    res = pool.uimap(busy_add, _x, _y, _d)
+    assert sorted(res) == sorted(std)
+    pool.close()
+    pool.join()
+
+def check_stream(scatter=False):
+    from pyina.launchers import Pool, Scatter
+    pool = (Scatter if scatter else Pool)(4)
+    _x = range(int(-items/2), int(items/2), 2)
+    _y = range(len(_x))
+    _d = [0]*len(_x)
+    res = pool.imap(busy_add, _x, _y, _d, chunksize=3)
+    assert list(res) == std
+    res = pool.uimap(busy_add, _x, _y, _d, chunksize=3)
+    assert sorted(res) == sorted(std)
+
+def writeable(x, y):
+    return (x.flags.writeable, x.sum() + y)
+
+def check_shared(scatter=False):
+    import numpy as np
+    from pyina.launchers import Pool, Scatter
+    pool = (Scatter if scatter else Pool)(4, shared=True)
+    x = [np.arange(5.)*i for i in range(items)]
+    res = pool.map(writeable, x, range(items))
+    assert [i[1] for i in res] == [i.sum() + j for (i,j) in zip(x, range(items))]
+    if scatter: # otherwise, the master's jobs are copied to a subprocess
+        assert not any(i[0] for i in res)
+
+def doubled(x, y):
+    x *= 2 # the input is changed in place
+    return (x.flags.writeable, x.sum() + y)
+
+def check_mmap(scatter=False):
+    import os, glob, tempfile
+    import numpy as np
+    from pyina.launchers import Pool, Scatter
+    pool = (Scatter if scatter else Pool)(4, workdir=tempfile.mkdtemp(), cache=False)
+    x = np.arange(items*5.).reshape(items, 5)
+    res = pool.map(doubled, x, range(items))
+    assert [i[1] for i in res] == [2*i.sum() + j for (i,j) in zip(x, range(items))]
+    assert all(i[0] for i in res)
+    assert not glob.glob(os.path.join(pool.workdir, '*.npy'))
+    os.rmdir(pool.workdir)
+
+def test_collective():
+    check_collective(True)
+    check_collective(False)
+
+def test_weights():
+    check_collective(True, weights=[i*i for i in range(items//2)])
+    check_collective(False, weights=lambda x,y,d: abs(x)+y)
+
+def test_ndarray():
+    check_ndarray()
+    check_ndarray(scatter=True)
+
+def test_persistent():
+    check_persistent()
+    check_persistent(scatter=True, source=True)
+
+def test_async():
+    check_async()
+    check_async(scatter=True)
+    check_async(persistent=True)
+
+def test_stream():
+    check_stream()
+    check_stream(scatter=True)
+
+def test_mmap():
+    check_mmap()
+    check_mmap(scatter=True)
+
+def test_cache():
+    import os, tempfile
+    from pyina.launchers import Pool
+    from pyina import mpi
+    pool = Pool(2, workdir=tempfile.mkdtemp())
+    size, mpi._MAXFUNCS[0] = mpi._MAXFUNCS[0], 2
+    try:
+        assert pool.map(abs, [-1, 2]) == [1, 2]
+        assert pool.map(abs, [-3]) == [3]
+        names = [i for i in mpi._FUNCS if i.startswith(pool.workdir)]
+        assert len(names) == 1 and os.path.exists(names[0])
+        assert not mpi._FUNCS[names[0]] # no map is using the file
+        for i in range(3): # the least recently used file is removed
+            assert pool.map(lambda x, i=i: x+i, [0]) == [i]
+        assert names[0] not in mpi._FUNCS and not os.path.exists(names[0])
+        pool = Pool(2, workdir=pool.workdir, cache=False)
+        assert pool.map(abs, [-1]) == [1]
+        assert len(mpi._FUNCS) == 2 # the last two (cached) funcs
+    finally:
+        mpi._MAXFUNCS[0] = size
+        mpi._clear_cache()
+    assert not os.listdir(pool.workdir)
+    os.rmdir(pool.workdir)
+
+def test_cache_processes():
+    import os, sys, tempfile, subprocess
+    from pyina.launchers import Pool
+    from pyina import mpi
+    workdir = tempfile.mkdtemp()
+    pool = Pool(2, workdir=workdir)
+    try:
+        assert pool.map(abs, [-1]) == [1]
+        names = [i for i in mpi._FUNCS if i.startswith(workdir)]
+        # another process maps the same function in the same workdir, then exits
+        script = "from pyina.launchers import Pool; " \
+                 "assert Pool(2, workdir=%r).map(abs, [-2]) == [2]" % workdir
+        subprocess.check_call([sys.executable, '-c', script])
+        assert len(names) == 1 and os.path.exists(names[0])
+        assert pool.map(abs, [-3]) == [3]
+    finally:
+        mpi._clear_cache()
+    assert not os.listdir(workdir)
+    os.rmdir(workdir)
+
+def test_serializer():
+    import pickle
+    from pyina.launchers import Pool, Scatter
+    from pyina.tools import get_serializer, register_serializer
+    assert get_serializer('pickle') == (pickle.dumps, pickle.loads)
+    register_serializer('reverse', lambda x, *args: pickle.dumps(x)[::-1],
+                                   lambda x: pickle.loads(bytes(x)[::-1]))
+    dumps, loads = get_serializer('reverse')
+    assert loads(dumps([1, 2])) == [1, 2]
+    try:
+        Pool(2, serializer='unknown')
+        assert False
+    except ValueError:
+        pass
+    for pool in (Pool, Scatter):
+        for serializer in ('pickle', (dumps, loads)):
+            res = pool(4, serializer=serializer).map(abs, range(-5, 5))
+            assert res == list(map(abs, range(-5, 5)))
+
+def check_compression(scatter=False):
+    import numpy as np
+    from pyina.launchers import Pool, Scatter
+    pool = (Scatter if scatter else Pool)(4, compression='zlib')
+    x = [np.zeros(10000) + i for i in range(8)]
+    res = pool.map(np.sum, x)
+    assert res == [10000. * i for i in range(8)]
+
+def test_compression():
+    check_compression()
+    check_compression(scatter=True)
+
+def check_stats(scatter=False):
+    from pyina.launchers import Pool, Scatter
+    pool = (Scatter if scatter else Pool)(4, timing=True)
+    res = pool.map(abs, range(-10, 10))
+    assert res == list(map(abs, range(-10, 10)))
+    stats = pool.stats
+    assert stats['strategy'] == ('mpi_scatter' if scatter else 'mpi_pool')
+    assert stats['size'] == 4 and stats['njobs'] == 20
+    assert sorted(task[1] for task in stats['tasks']) == list(range(20))
+    assert sorted(rank['rank'] for rank in stats['ranks']) == list(range(4))
+    assert stats['elapsed'] > 0
+    # without timing, there are no stats
+    pool.timing = False
+    pool.map(abs, range(-2, 2))
+    assert pool.stats is None
+
+def test_stats():
+    check_stats()
+    check_stats(scatter=True)
+
+def test_trace():
+    import os, json, tempfile
+    from pyina.launchers import Pool
+    filename = tempfile.mktemp(suffix='.json')
+    pool = Pool(4)
+    res = pool.map(abs, range(-10, 10), trace=filename)
+    assert res == list(map(abs, range(-10, 10)))
+    with open(filename) as file:
+        events = json.load(file)['traceEvents']
+    os.remove(filename)
+    tracks = set(event['tid'] for event in events if event['ph'] == 'X')
+    assert tracks == set(range(4))
+    tasks = [event for event in events if event.get('cat') == 'task']
+    assert sorted(event['args']['index'] for event in tasks) == list(range(20))
+
+def test_phases():
+    from pyina.launchers import Pool
+    pool = Pool(2)
+    result = pool.amap(abs, range(-5, 5))
+    assert result.get() == list(map(abs, range(-5, 5)))
+    phases = ['modularize', 'pickleargs', 'command', 'launch', 'startup',
+              'load', 'compute', 'dump', 'wait', 'cleanup', 'total', 'overhead']
+    assert list(result.phases) == phases and pool.phases is result.phases
+    assert result.phases['total'] > result.phases['overhead'] > 0
+    assert result.phases['compute'] >= 0 and result.phases['load'] >= 0
+
+def test_fallback():
+    import os, json, tempfile
+    from pyina import mpi
+    from pyina.launchers import Pool
+    costs = mpi._COSTS[0]
+    mpi._COSTS[0] = tempfile.mktemp(suffix='.json')
+    try:
+        try:
+            Pool(2, fallback='unknown')
+            assert False
+        except ValueError:
+            pass
+        # forced to run in-process, or on a local process pool
+        for where in ('serial', 'local'):
+            pool = Pool(2, fallback=where)
+            assert pool.map(abs, range(-5, 5)) == list(map(abs, range(-5, 5)))
+            assert list(pool.phases) == ['total']
+        assert not os.path.exists(mpi._COSTS[0])
+        # the first map is launched, to learn the overhead and the costs
+        pool = Pool(2, fallback=True)
+        assert pool.map(abs, range(-5, 5)) == list(map(abs, range(-5, 5)))
+        assert 'launch' in pool.phases
+        with open(mpi._COSTS[0]) as file:
+            cached = json.load(file)
+        assert 'builtins.abs' in cached['costs']
+        assert cached['overheads'][pool._launchname()] > 0
+        # then a small map is predicted to be faster in-process
+        assert pool.map(abs, range(-5, 5)) == list(map(abs, range(-5, 5)))
+        assert list(pool.phases) == ['total']
+        # each lambda has its own entry
+        double = lambda x: 2*x
+        triple = lambda x: 3*x
+        assert mpi._costkey(double) != mpi._costkey(triple)
+        pool = Pool(2, fallback=True)
+        pool.map(double, range(20))
+        pool.map(triple, range(20))
+        with open(mpi._COSTS[0]) as file:
+            cached = json.load(file)
+        assert mpi._costkey(double) in cached['costs']
+        assert mpi._costkey(triple) in cached['costs']
+    finally:
+        if os.path.exists(mpi._COSTS[0]): os.remove(mpi._COSTS[0])
+        mpi._COSTS[0] = costs
+
+def check_hierarchical(scatter=False):
+    from pyina.launchers import Pool, Scatter
+    # one node (with one task per node, only one node is on this host)
+    pool = (Scatter if scatter else Pool)('1:ppn=4', hierarchical=True,
+                                          timing=True)
+    res = pool.map(abs, range(-10, 10))
+    assert res == list(map(abs, range(-10, 10)))
+    # one task per node, each with a local pool of ppn processes
+    assert pool.stats['size'] == 1
+    assert sorted(task[1] for task in pool.stats['tasks']) == list(range(20))
+
+def test_hierarchical():
+    check_hierarchical()
+    check_hierarchical(scatter=True)
+
+def test_unread():
+    import os, gc, tempfile
+    import numpy as np
+    from pyina.launchers import Pool
+    # the files of a map are removed, even if the results are never read
+    for persistent in (False, True):
+        workdir = tempfile.mkdtemp()
+        pool = Pool(2, workdir=workdir, cache=False, persistent=persistent)
+        result = pool.amap(np.sum, np.ones((10,3)))
+        del result
+        gc.collect()
+        pool.close()
+        pool.join()
+        assert os.listdir(workdir) == []
+        os.rmdir(workdir)
+
+def test_shared():
+    check_shared()
+    check_shared(scatter=True)
+
 def test_source():
     check_serial(source=True)
     check_pool(source=True)
@@ -87,4 +433,24 @@ if __name__ == '__main__':
         print("")
 
     test_nosource()
+    test_chunksize()
+    test_schedule()
+    test_collective()
+    test_weights()
+    test_ndarray()
+    test_persistent()
+    test_async()
+    test_stream()
+    test_mmap()
+    test_cache()
+    test_cache_processes()
+    test_serializer()
+    test_compression()
+    test_stats()
+    test_trace()
+    test_phases()
+    test_fallback()
+    test_hierarchical()
+    test_unread()
+    test_shared()
     test_source()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+#
+# Author: Mike McKerns (mmckerns @caltech and @uqfoundation)
+# Copyright (c) 2026 The Uncertainty Quantification Foundation.
+# License: 3-clause BSD.  The full license text is available at:
+#  - https://github.com/uqfoundation/pyina/blob/master/LICENSE
+
+import os
+import tempfile
+from pyina.schedulers import Scheduler, Torque, Moab, Lsf, Sbatch
+from pyina.tools import open_results, close_results
+
+
+def jobid(scheduler, output):
+    jobfile = tempfile.mktemp()
+    with open(jobfile, 'w') as file:
+        file.write(output)
+    try:
+        return scheduler._jobid(jobfile)
+    finally:
+        os.remove(jobfile)
+
+def test_jobid():
+    assert jobid(Torque(), '1234.server.edu\n') == '1234.server.edu'
+    assert jobid(Moab(), '\nMoab.1234\n') == 'Moab.1234'
+    assert jobid(Sbatch(), 'Submitted batch job 1234\n') == '1234'
+    assert jobid(Lsf(), 'Job <1234> is submitted to queue <normal>.\n') == '1234'
+    assert jobid(Scheduler(), '1234\n') is None
+    assert Sbatch()._jobid(tempfile.mktemp()) is None
+
+
+class Staged(Sbatch):
+    """a scheduler that reports a fixed sequence of job states"""
+    def __init__(self, *states, **kwds):
+        Sbatch.__init__(self, **kwds)
+        self.states = list(states)
+    def _jobid(self, jobfile=None):
+        return '1234'
+    def _state(self, jobid):
+        return self.states.pop(0) if len(self.states) > 1 else self.states[0]
+
+def test_wait():
+    import time
+    filename = tempfile.mktemp()
+    # the job fails
+    start = time.time()
+    try:
+        Staged('queued', 'running', 'failed')._wait(filename)
+        assert False
+    except IOError:
+        pass
+    assert time.time() - start < 5
+    # the job finishes without results
+    try:
+        Staged('running', 'done')._wait(filename, maxwait=0.2)
+        assert False
+    except IOError:
+        pass
+    # the job exceeds the timeout
+    try:
+        Staged('running')._wait(filename, timeout=0.5)
+        assert False
+    except TimeoutError:
+        pass
+    # the job writes the results
+    close_results(open_results(filename))
+    Staged('done')._wait(filename)
+    os.remove(filename)
+
+
+if __name__ == '__main__':
+    test_jobid()
+    test_wait()
@@ -50,3 +50,24 @@ launcher = Alps(scheduler=scheduler)
 assert launcher._nodes() == scheduler._nodes()
 assert launcher._tasks() == _tasks
 assert scheduler._tasks() == nodes
+
+launcher = Mpi(nodes)
+assert launcher._tasks() == '100'
+assert launcher._hierarchy() == ('10 --map-by ppr:1:node', 10)
+launcher = Mpi(4)
+assert launcher._hierarchy() == ('4 --map-by ppr:1:node', 1)
+
+# with hierarchical=True, each launcher places one task on each node
+config = {'python':'python', 'program':'ezpool', 'progargs':''}
+launcher = Mpi('2:ppn=4', hierarchical=True)
+config['nodes'], ppn = launcher._hierarchy()
+assert ppn == 4
+assert ' -np 2 --map-by ppr:1:node python ezpool' in launcher._launcher(config)
+launcher = Slurm('2:ppn=4', hierarchical=True)
+config['nodes'], ppn = launcher._hierarchy()
+assert ppn == 4
+assert launcher._launcher(config).startswith('srun -n2 -N2 --ntasks-per-node=1 python ezpool')
+launcher = Alps('2:ppn=4', hierarchical=True)
+config['nodes'], ppn = launcher._hierarchy()
+assert ppn == 4
+assert launcher._launcher(config).startswith('aprun -n 2 -N 1 python ezpool')
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+#
+# Author: Mike McKerns (mmckerns @caltech and @uqfoundation)
+# Copyright (c) 2026 The Uncertainty Quantification Foundation.
+# License: 3-clause BSD.  The full license text is available at:
+#  - https://github.com/uqfoundation/pyina/blob/master/LICENSE
+
+import os
+import tempfile
+import numpy as np
+from pyina import tools
+
+
+def loop_workload(index, nproc, popsize, skip=None):
+    """the workload, calculated with a loop over the nodes (as in pyina-0.3)"""
+    from math import ceil
+    if skip is not None and skip < nproc:
+        nproc = nproc - 1
+        if index == skip: skip = True
+        elif index > skip: index = index - 1
+    n1, n2, iend = nproc, popsize, 0
+    for i in range(nproc):
+        ibegin = iend
+        ai = int(ceil(1.0*n2/n1))
+        n2, n1, iend = n2 - ai, n1 - 1, iend + ai
+        if i == index: break
+    if skip is True:
+        return (ibegin, ibegin) if (index < nproc) else (iend, iend)
+    return (ibegin, iend)
+
+def test_workload():
+    for nproc in range(1, 10):
+        for popsize in list(range(0, 30)) + [997, 10**12+7]:
+            for skip in [None] + list(range(nproc+2)):
+                bounds = list(zip(*tools.balance_workload(nproc, popsize, skip=skip)))
+                begin, end = tools.get_workloads(nproc, popsize, skip=skip)
+                assert list(zip(begin.tolist(), end.tolist())) == bounds
+                work = [tools.get_workload(i, nproc, popsize, skip=skip) \
+                        for i in range(nproc)]
+                assert work == bounds
+                if nproc == 1 and skip == 0: continue # there are no workers
+                # the jobs are split into contiguous chunks
+                assert sum(e - b for (b, e) in bounds) == popsize
+                assert all(e == b for ((_, e), (b, _)) in zip(bounds, bounds[1:]))
+                if popsize > 1000: continue # the loop uses floats
+                assert work == [loop_workload(i, nproc, popsize, skip=skip) \
+                                for i in range(nproc)]
+    assert tools.balance_workload(7, 12, 3) == tools.get_workload(3, 7, 12)
+
+def test_results():
+    filename = tempfile.mktemp()
+    file = tools.open_results(filename)
+    tools.dump_results(file, 3, ['d', 'e'])
+    tools.dump_results(file, 0, ['a', 'b', 'c'])
+    tools.dump_results(file, 5, [])
+    assert not tools.results_ready(filename)
+    assert next(tools.iload_results(filename)) == (3, ['d', 'e'])
+    tools.close_results(file)
+    assert tools.results_ready(filename)
+    res = list(tools.iload_results(filename))
+    assert res == [(3, ['d', 'e']), (0, ['a', 'b', 'c'])]
+    assert tools.load_results(filename) == ['a', 'b', 'c', 'd', 'e']
+    os.remove(filename)
+
+def test_signal():
+    import threading
+    filename = tempfile.mktemp()
+    signal, name = tools.open_signal()
+    def write():
+        file = tools.open_results(filename, signal=name)
+        if signal is not None: assert file._signal is not None
+        for i in range(3):
+            tools.dump_results(file, i, [i])
+        tools.close_results(file)
+    writer = threading.Thread(target=write)
+    writer.start()
+    res = list(tools.iload_results(filename, signal=signal))
+    writer.join()
+    assert res == [(0, [0]), (1, [1]), (2, [2])]
+    tools.close_signal(signal, name)
+    if name is not None: assert not os.path.exists(os.path.dirname(name))
+    os.remove(filename)
+
+def test_args():
+    x = [np.arange(6.).reshape(2,3), np.ones((3,2), order='F'), np.arange(4)[::2]]
+    filename = tempfile.mktemp()
+    with open(filename, 'wb') as file:
+        tools.dump_args((x, [1, 2, 3]), {'onall': False}, file)
+    args, kwds, window = tools.load_args(filename)
+    assert window is None and kwds == {'onall': False}
+    assert args[1] == [1, 2, 3]
+    assert all(np.array_equal(i, j) for (i,j) in zip(args[0], x))
+    assert not args[0][0].flags.writeable and args[0][1].flags.f_contiguous
+    os.remove(filename)
+
+def test_sharded():
+    x, y = list(range(100)), np.arange(37.)
+    filename = tempfile.mktemp()
+    with open(filename, 'wb') as file:
+        tools.dump_sharded((x, y), {'onall': False}, file, nblocks=8)
+    args, kwds, window = tools.load_args(filename)
+    assert window is None and kwds == {'onall': False}
+    assert [len(i) for i in args] == [100, 37]
+    for i in (slice(0,100), slice(13,47), slice(90,200), slice(3,50,7), -1):
+        assert args[0][i] == x[i]
+        assert np.array_equal(args[1][i], y[i])
+    assert tools.lookup(args, 2, 5) == ([2, 3, 4], [2., 3., 4.])
+    assert list(args[0]) == x
+    os.remove(filename)
+
+def test_arrays():
+    x, y = np.arange(12.).reshape(4,3), np.array([None, 1, 'a'])
+    with tempfile.NamedTemporaryFile() as file:
+        names = tools.dump_arrays((x, y, [1, 2]), {'onall': False}, file)
+        file.flush()
+        assert names == [file.name + '.0.npy']
+        args, kwds, window = tools.load_args(file.name)
+    assert window is None and kwds == {'onall': False}
+    assert type(args[0]) is np.ndarray and args[0].flags.writeable
+    assert np.array_equal(args[0], x) and np.array_equal(args[1], y)
+    assert args[2] == [1, 2]
+    args[0][0] = -1 # the change is not written to the file
+    assert np.array_equal(np.load(names[0]), x)
+    del args
+    os.remove(names[0])
+
+def test_compress():
+    data = np.zeros(1 << 15).tobytes()
+    packed = tools.compress(data, 'zlib')
+    assert packed.startswith(tools._ZIP) and len(packed) < len(data)
+    assert tools.decompress(packed) == data
+    # small, incompressible, or uncompressed data is unchanged
+    assert tools.compress(data[:100], 'zlib') == data[:100]
+    assert tools.compress(data, 'zlib', threshold=len(data)+1) == data
+    noise = np.random.bytes(1 << 17)
+    assert tools.compress(noise, 'zlib') == noise
+    assert tools.compress(data, None) == data
+    assert tools.decompress(data) == data
+    try:
+        tools.compress(data, 'unknown')
+        assert False
+    except ValueError:
+        pass
+
+def test_compressor():
+    compressors = tools._COMPRESSORS
+    try: # zstd and lz4 are not installed, so fall back to zlib
+        tools._COMPRESSORS = (('zlib', 'zlib'), ('zstd', 'no_zstd'), \
+                              ('lz4', 'no_lz4'))
+        assert tools.get_compressor(True)[0] == 'zlib'
+        try:
+            tools.get_compressor('zstd')
+            assert False
+        except ValueError:
+            pass
+    finally:
+        tools._COMPRESSORS = compressors
+    name = tools.get_compressor(True)[0]
+    data = np.zeros(1 << 15).tobytes()
+    assert tools.decompress(tools.compress(data, name)) == data
+
+def test_compressed_files():
+    x = [np.zeros(1000) for i in range(20)]
+    filename = tempfile.mktemp()
+    # a results file with compressed records
+    file = tools.open_results(filename, compression='zlib')
+    tools.dump_results(file, 0, x)
+    tools.dump_results(file, 20, ['a'])
+    tools.close_results(file)
+    assert os.path.getsize(filename) < x[0].nbytes
+    res = tools.load_results(filename)
+    assert len(res) == 21 and res[-1] == 'a'
+    assert all(np.array_equal(i, j) for (i,j) in zip(res, x))
+    # a sharded args file with compressed blocks
+    with open(filename, 'wb') as file:
+        tools.dump_sharded((x,), {}, file, nblocks=2, compression='zlib')
+    assert os.path.getsize(filename) < x[0].nbytes
+    args, kwds, window = tools.load_args(filename)
+    assert np.array_equal(args[0][13], x[13]) and len(args[0]) == 20
+    # a compressed pickle of args
+    with open(filename, 'wb') as file:
+        file.write(tools.compress(tools.dill.dumps(((x,), {})), 'zlib'))
+    args, kwds, window = tools.load_args(filename)
+    assert np.array_equal(args[0][-1], x[-1]) and kwds == {}
+    os.remove(filename)
+
+def test_incomplete_results():
+    filename = tempfile.mktemp()
+    # a missing results file
+    try:
+        tools.load_results(filename, alive=lambda: False)
+        assert False
+    except IOError:
+        pass
+    # an incomplete results file
+    file = tools.open_results(filename)
+    tools.dump_results(file, 0, [1, 2])
+    try:
+        tools.load_results(filename, alive=lambda: False)
+        assert False
+    except IOError:
+        pass
+    tools.close_results(file)
+    assert tools.load_results(filename, alive=lambda: False) == [1, 2]
+    os.remove(filename)
+
+def test_serializer():
+    import sys, subprocess
+    # importing pyina does not change the pickle used by mpi4py
+    script = "import pyina, pickle; from mpi4py import MPI\n" \
+             "try: MPI.pickle.dumps(lambda x: x)\n" \
+             "except (pickle.PicklingError, AttributeError): pass\n" \
+             "else: raise AssertionError('mpi4py pickle was changed')"
+    subprocess.check_call([sys.executable, '-c', script])
+
+def test_stats():
+    import time, json
+    # a disabled recorder is just a map
+    recorder = tools.Recorder(0, enabled=False)
+    assert recorder.map(abs, 0, [-1, -2]) == [1, 2]
+    recorder.wait('recv', 0.)
+    assert recorder.tasks == [] and recorder.waits == {}
+    # phases are recorded, even if disabled
+    assert recorder.timed('dump', abs)(-1) == 1
+    recorder.phase('load', recorder.start)
+    assert sorted(recorder.phases) == ['dump', 'load'] and not recorder.spans
+    # records from two ranks
+    records = []
+    for rank in range(2):
+        recorder = tools.Recorder(rank)
+        assert recorder.map(abs, 2*rank, [-1, -2]) == [1, 2]
+        recorder.message('recv', 1-rank, 8, recorder.start)
+        recorder.wait('send', recorder.start)
+        records.append(dict(rank=rank, start=recorder.start, stop=time.time(),
+                            tasks=recorder.tasks, messages=recorder.messages,
+                            spans=recorder.spans, waits=recorder.waits,
+                            nbytes=recorder.nbytes))
+    stats = tools.merge_stats(records, strategy='test')
+    assert stats['strategy'] == 'test' and stats['elapsed'] >= 0
+    assert sorted(task[1] for task in stats['tasks']) == [0, 1, 2, 3]
+    assert [rank['ntasks'] for rank in stats['ranks']] == [2, 2]
+    assert [rank['nbytes'] for rank in stats['ranks']] == [{'recv': 8}] * 2
+    assert len(stats['messages']) == 2 and len(stats['spans']) == 2
+    # stats are written as json beside the results
+    filename = tempfile.mktemp()
+    assert tools.load_stats(filename) is None
+    tools.dump_stats(filename, stats)
+    assert tools.load_stats(filename)['ranks'] == stats['ranks']
+    os.remove(filename + '.stats')
+    # a trace has a track for each rank, and a span for each task and message
+    events = tools.trace_events(stats)
+    spans = [event for event in events if event['ph'] == 'X']
+    assert set(event['tid'] for event in spans) == set([0, 1])
+    assert sorted(event['args']['index'] for event in spans \
+                  if event['cat'] == 'task') == [0, 1, 2, 3]
+    assert len(spans) == 4 + 2 + 2
+    assert all(event['dur'] >= 0 and event['ts'] >= 0 for event in spans)
+    tools.dump_trace(filename, stats)
+    with open(filename) as file:
+        assert len(json.load(file)['traceEvents']) == len(events)
+    os.remove(filename)
+
+def test_costs():
+    filename = tempfile.mktemp(suffix='.json')
+    model = tools.CostModel(filename)
+    # the time of the launcher is not known, so launch
+    assert model.choose('f', 'Pool(4)', 10, 4) is None
+    model.update('f', 'Pool(4)', 10, 4, elapsed=1.1, overhead=1.)
+    assert abs(model.costs['f'] - 0.04) < 1e-12
+    assert model.overheads['Pool(4)'] == 1.
+    # few items are faster in-process, and many items are faster launched
+    assert model.choose('f', 'Pool(4)', 10, 4, ncpus=1) == 'serial'
+    assert model.choose('f', 'Pool(4)', 10**6, 4, ncpus=1) is None
+    assert model.choose('f', 'Pool(4)', 100, 4, ncpus=4) == 'local'
+    # the overhead of a local pool is learned from the cost of the items
+    model.update('f', 'local', 100, 4, elapsed=1.2)
+    assert abs(model.overheads['local'] - (0.1 + 0.2)/2) < 1e-12
+    # the costs are cached in the file
+    model.save()
+    cached = tools.CostModel(filename)
+    assert cached.costs == model.costs and cached.overheads == model.overheads
+    os.remove(filename)
+
+def test_fanout():
+    from pathos.helpers import ProcessPool
+    pool = ProcessPool(2)
+    try:
+        # the pieces are joined in order
+        pieces = tools.fanout(pool, 2, abs, 10, range(-5, 0))
+        assert tools.fanin(pieces.get()) == ([5, 4, 3, 2, 1], [])
+        # with more processes than jobs, and with the time of each task
+        pieces = tools.fanout(pool, 4, pow, 3, [1, 2], [2, 2], timed=True)
+        results, tasks = tools.fanin(pieces.get())
+        assert results == [1, 4] and [task[0] for task in tasks] == [3, 4]
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    test_workload()
+    test_results()
+    test_signal()
+    test_args()
+    test_sharded()
+    test_arrays()
+    test_compress()
+    test_compressor()
+    test_compressed_files()
+    test_incomplete_results()
+    test_serializer()
+    test_stats()
+    test_costs()
+    test_fanout()
@@ -11,6 +11,7 @@ Various mpi python tools
 Main function exported are::
     - ensure_mpi: make sure the script is called by mpi-enabled python
     - get_workload: get the workload the processor is responsible for
+    - get_workloads: get the workloads of all the processors at once
 
 """
 def ensure_mpi(size = 1, doc = None):
@@ -42,7 +43,6 @@ def mpiprint(string="", end="\n", rank=0, comm=None):
 
 
 #XXX: has light load on *last* proc, heavy/equal on first proc
-from math import ceil
 def get_workload(index, nproc, popsize, skip=None):
     """returns the workload that this processor is responsible for
 
@@ -52,29 +52,47 @@ popsize: int number of jobs
 skip: int rank of node upon which to not calculate (i.e. the master)
 
 returns (begin, end) index
+
+NOTE: the first (popsize % nproc) nodes each get one more job than the
+others, where the (begin, end) is calculated directly, in constant time.
     """
     if skip is not None and skip < nproc:
         nproc = nproc - 1
         if index == skip: skip = True
         elif index > skip: index = index - 1
-    n1 = nproc
-    n2 = popsize
-    iend = 0
-    for i in range(nproc):
-        ibegin = iend
-        ai = int( ceil( 1.0*n2/n1 ))
-        n2 = n2 - ai
-        n1 = n1 - 1
-        iend = iend + ai
-        if i==index:
-           break
-    if skip is True:
-        return (ibegin, ibegin) if (index < nproc) else (iend, iend)
-    return (ibegin, iend) #XXX: (begin, end) index for a single element
+    size, extra = divmod(popsize, max(nproc, 1))
+    if skip is not True: index = min(index, nproc - 1)
+    begin = index * size + min(index, extra)
+    if skip is True: # the skipped node has no jobs
+        return (begin, begin)
+    return (begin, begin + size + (index < extra)) #XXX: (begin, end) index for a single element
+
+def get_workloads(nproc, popsize, skip=None):
+    """returns the workload that each of the processors is responsible for
+
+nproc: int number of nodes
+popsize: int number of jobs
+skip: int rank of node upon which to not calculate (i.e. the master)
+
+returns (begin, end) index vectors, as ndarrays of int
+
+NOTE: this is equivalent to get_workload for each of the nproc nodes"""
+    index = np.arange(nproc, dtype=np.int64)
+    skip = skip if (skip is not None and skip < nproc) else None
+    if skip is not None:
+        nproc = nproc - 1
+        index[skip+1:] -= 1
+    size, extra = divmod(popsize, max(nproc, 1))
+    begin = index * size + np.minimum(index, extra)
+    end = begin + size + (index < extra)
+    if skip is not None: # the skipped node has no jobs
+        end[skip] = begin[skip]
+    return begin, end
 
 
 #FIXME: has light load on *last* proc, heavy/equal on master proc
 import numpy as np
+import dill
 def balance_workload(nproc, popsize, *index, **kwds):
     """divide popsize elements on 'nproc' chunks
 
@@ -82,33 +100,66 @@ nproc: int number of nodes
 popsize: int number of jobs
 index: int rank of node(s) to calculate for (using slice notation)
 skip: int rank of node upon which to not calculate (i.e. the master)
+weights: list of float cost of each job (i.e. len(weights) == popsize)
 
-returns (begin, end) index vectors"""
-    _skip = False
+returns (begin, end) index vectors
+
+NOTE: if weights are given, the chunks are contiguous with a near-equal total
+cost (instead of a near-equal number of jobs), where the chunk boundaries are
+found by a binary search of the cumulative cost."""
     skip = kwds.get('skip', None)
-    if skip is not None and skip < nproc:
-        nproc = nproc - 1
-        _skip = True
-    count = int(np.round(popsize/nproc))
-    counts = count * np.ones(nproc, dtype=np.int64)
-    diff = popsize - count*nproc
-    counts[:diff] += 1
-    begin = np.concatenate(([0], np.cumsum(counts)[:-1]))
-   #return counts, index #XXX: (#jobs, begin index) for all elements
-    if _skip:
-        if skip == nproc: # remember: nproc has been reduced
-            begin = np.append(begin, begin[-1]+counts[-1])
-            counts = np.append(counts, 0)
-        else:
-            begin = np.insert(begin, skip, begin[skip])
-            counts = np.insert(counts, skip, 0)
-    begin = begin.tolist()
-    counts = counts.tolist()
+    weights = kwds.get('weights', None)
+    if weights is None: # the same as get_workload for each node
+        begin, end = get_workloads(nproc, popsize, skip=skip)
+        end = end.tolist()
+        begin = begin.tolist()
+    else:
+        _skip = False
+        if skip is not None and skip < nproc:
+            nproc = nproc - 1
+            _skip = True
+        counts = _weighted_counts(nproc, popsize, weights)
+        begin = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+       #return counts, index #XXX: (#jobs, begin index) for all elements
+        if _skip:
+            if skip == nproc: # remember: nproc has been reduced
+                begin = np.append(begin, begin[-1]+counts[-1])
+                counts = np.append(counts, 0)
+            else:
+                begin = np.insert(begin, skip, begin[skip])
+                counts = np.insert(counts, skip, 0)
+        end = (begin+counts).tolist()
+        begin = begin.tolist()
     if not index:
-        return begin, begin+counts #XXX: (begin, end) index for all elements
+        return begin, end #XXX: (begin, end) index for all elements
    #if len(index) > 1:
-   #    return lookup((begin, begin+counts), *index) # index a slice
-    return lookup((begin, begin+counts), *index) # index a single element
+   #    return lookup((begin, end), *index) # index a slice
+    return lookup((begin, end), *index) # index a single element
+
+def _weighted_counts(nproc, popsize, weights):
+    """get the number of jobs in each of 'nproc' chunks of near-equal cost
+
+nproc: int number of nodes
+popsize: int number of jobs
+weights: list of float cost of each job (i.e. len(weights) == popsize)
+
+returns a vector of the number of jobs in each chunk"""
+    cost = np.cumsum(np.asarray(weights, dtype=float))
+    if len(cost) != popsize:
+        raise ValueError("weights must have a length of %s" % popsize)
+    if not popsize:
+        return np.zeros(nproc, dtype=np.int64)
+    if not cost[-1] > 0: # no cost information, so use equal weights
+        cost = np.arange(1., popsize+1)
+    # the cumulative cost at the end of each chunk (except the last)
+    target = cost[-1] * np.arange(1, nproc) / nproc
+    split = np.searchsorted(cost, target) # first job reaching each target
+    # end each chunk before or after that job, whichever is closer to target
+    before = np.where(split > 0, cost[np.maximum(split-1, 0)], 0.)
+    after = cost[np.minimum(split, popsize-1)]
+    split = np.where(target - before <= after - target, split, split+1)
+    split = np.maximum.accumulate(np.minimum(split, popsize))
+    return np.diff(np.concatenate(([0], split, [popsize]))).astype(np.int64)
 
 def lookup(inputs, *index):
     """get tuple of inputs corresponding to the given index"""
@@ -116,6 +167,889 @@ def lookup(inputs, *index):
     else: index = slice(*index)
     return tuple(i.__getitem__(index) for i in inputs)
 
+def as_buffer(results):
+    """stack a list of ndarrays (or numpy scalars) into a contiguous ndarray
+
+results: list of ndarray or numpy scalar, all of the same type, dtype and shape
+
+returns an ndarray of shape (len(results),)+shape, or None if the results
+can not be sent as a single buffer (i.e. with Send/Recv)"""
+    if not len(results): return None
+    first = results[0]
+    if type(first) is not np.ndarray and not isinstance(first, np.generic):
+        return None
+    if first.dtype.hasobject: return None
+    if type(first) is np.ndarray and not first.ndim: # would return scalars
+        return None
+    kind, dtype, shape = type(first), first.dtype, np.shape(first)
+    for result in results:
+        if type(result) is not kind or result.dtype != dtype \
+                                    or np.shape(result) != shape:
+            return None
+    return np.ascontiguousarray(np.stack(results))
+
+# serializers for the mpi transport and results, as {name: module} or as
+# {name: (dumps, loads)}, where each module provides dumps and loads
+_SERIALIZERS = {'dill': 'dill', 'pickle': 'pickle', 'cloudpickle': 'cloudpickle'}
+
+def register_serializer(name, dumps, loads):
+    """register a serializer, for use with use_serializer
+
+name: str name of the serializer
+dumps: function that pickles an object, as dumps(obj, protocol=None)
+loads: function that unpickles an object, as loads(data)"""
+    _SERIALIZERS[name] = (dumps, loads)
+    return
+
+def get_serializer(name=None):
+    """get the (dumps, loads) functions for the named serializer
+
+name: str name of a registered serializer [default: 'dill']
+
+NOTE: 'dill', 'pickle' and 'cloudpickle' are registered by default. If name
+is a tuple of (dumps, loads) functions, the tuple is returned."""
+    if name is None: name = 'dill'
+    if isinstance(name, tuple): return name
+    serializer = _SERIALIZERS.get(name, None)
+    if serializer is None:
+        raise ValueError("unknown serializer: %s" % name)
+    if not isinstance(serializer, str):
+        return serializer
+    import importlib
+    try:
+        module = importlib.import_module(serializer)
+    except ImportError:
+        raise ValueError("serializer is not installed: %s" % name)
+    return module.dumps, module.loads
+
+def use_serializer(name=None):
+    """use the named serializer for objects sent with mpi (see get_serializer)
+
+NOTE: this configures the pickle used by mpi4py, thus applies to all objects
+sent with the lowercase methods of any communicator in this process. With
+'pickle', the highest protocol is used. The objects are pickled in-band (ndarray
+results are instead sent as raw buffers by pyina.mpi_pool and mpi_scatter)."""
+    from mpi4py import MPI
+    dumps, loads = get_serializer(name)
+    protocol = -1 if name == 'pickle' else None
+    pickler = getattr(MPI,'pickle',getattr(MPI,'_p_pickle',None))
+    try:
+        pickler.__init__(dumps, loads, protocol)
+    except TypeError: # an older mpi4py
+        pickler.dumps, pickler.loads = dumps, loads
+    return
+
+# compressors for args and results files, as (name, module), in the order
+# of preference, where each module provides compress and decompress
+_COMPRESSORS = (('zlib', 'zlib'), ('zstd', 'zstandard'), ('lz4', 'lz4.frame'))
+_PREFERRED = ('zstd', 'lz4', 'zlib')
+_ZIP = b'pyina-zip:' # followed by a byte for the compressor, then the data
+_MINZIP = 1 << 16 # the smallest data that is compressed
+
+def get_compressor(name=True):
+    """get the (name, compress, decompress) for the named compressor
+
+name: str name of a compressor, or True for the first that is installed
+
+NOTE: the available compressors are 'zstd' (with zstandard), 'lz4' (with lz4),
+and 'zlib', where True selects from these in the given order."""
+    import importlib
+    names = _PREFERRED if name is True else (name,)
+    modules = dict(_COMPRESSORS)
+    for name in names:
+        if name not in modules:
+            raise ValueError("unknown compressor: %s" % name)
+        try:
+            module = importlib.import_module(modules[name])
+        except ImportError:
+            continue
+        return name, module.compress, module.decompress
+    raise ValueError("compressor is not installed: %s" % name)
+
+def compress(data, name=True, threshold=_MINZIP):
+    """compress the data, so it can be detected and decompressed by decompress
+
+data: bytes to compress
+name: str name of a compressor, or True for the first that is installed
+threshold: int smallest size of data that is compressed [default: 64 KB]
+
+NOTE: the data is returned unchanged if it is smaller than threshold, or if
+name is None or False, or if compressing does not make the data smaller."""
+    if not name or len(data) < threshold: return data
+    name, compress, _ = get_compressor(name)
+    index = [i for (i,_) in _COMPRESSORS].index(name)
+    compressed = _ZIP + bytes([index]) + compress(data)
+    return compressed if len(compressed) < len(data) else data
+
+def decompress(data):
+    """decompress the data, if it was compressed (see compress)"""
+    if bytes(data[:len(_ZIP)]) != _ZIP: return data
+    name = _COMPRESSORS[data[len(_ZIP)]][0]
+    return get_compressor(name)[2](data[len(_ZIP)+1:])
+
+# results files are written as a header, then a sequence of records
+_HEADER = b'pyina-results:' # followed by a byte flag, set when complete
+_RECORD = '<Q' # each record is the size of the pickled record, then the record
+
+def open_results(filename, serializer=None, compression=None, signal=None):
+    """open a results file for writing a stream of records (see dump_results)
+
+filename: path to the results file
+serializer: name of the serializer for the records [default: 'dill']
+compression: name of a compressor for the records [default: None]
+signal: path to the named pipe of the reader [default: None]
+
+returns the open file, which should be closed with close_results
+
+NOTE: if the reader is waiting on a named pipe (see open_signal), the reader
+is signaled each time a record is written."""
+    import os
+    file = open(filename, 'wb')
+    file.write(_HEADER + b'\x00')
+    file.flush()
+    file._dumps = get_serializer(serializer)[0]
+    file._compression = compression
+    try: # the named pipe only has a reader if the reader is on this host
+        file._signal = os.open(signal, os.O_WRONLY|os.O_NONBLOCK)
+    except (AttributeError, OSError, TypeError):
+        file._signal = None
+    return file
+
+def _notify(file):
+    """signal the reader of the results file, if it has a named pipe"""
+    if getattr(file, '_signal', None) is None: return
+    import os
+    try:
+        os.write(file._signal, b'\x00')
+    except OSError: # the pipe is full, or the reader has stopped
+        pass
+    return
+
+def dump_results(file, begin, results):
+    """append a record of results to an open results file
+
+file: open results file (see open_results)
+begin: int index of the first of the results in the map
+results: list of results
+
+NOTE: each record is written and flushed at once, so it can be read as soon
+as it is written (see iload_results)."""
+    if not len(results): return
+    import struct
+    record = compress(file._dumps((begin, results)), file._compression)
+    file.write(struct.pack(_RECORD, len(record)))
+    file.write(record)
+    file.flush()
+    _notify(file)
+    return
+
+def close_results(file):
+    """mark a results file as complete, then close it"""
+    file.flush()
+    file.seek(len(_HEADER))
+    file.write(b'\x01')
+    file.close()
+    _notify(file)
+    if getattr(file, '_signal', None) is not None:
+        import os
+        os.close(file._signal)
+    return
+
+def results_ready(filename):
+    """True if the results file has been completely written"""
+    try:
+        with open(filename, 'rb') as file:
+            return file.read(len(_HEADER)+1) == _HEADER + b'\x01'
+    except IOError:
+        return False
+
+def open_signal():
+    """make a named pipe, to be signaled when records are written to a file
+
+returns a tuple of (file descriptor, path) of the pipe, or (None, None) if a
+pipe can not be made. The path should be given to the writer of the file
+(see open_results), and the pipe should be removed with close_signal.
+
+NOTE: the pipe is made in a private temporary directory, and only signals
+writers on the same host as the reader, thus readers should still poll for
+results (see wait_signal)."""
+    import os, shutil, tempfile
+    tmpdir = tempfile.mkdtemp(prefix='pyina-')
+    name = os.path.join(tmpdir, 'signal')
+    try:
+        os.mkfifo(name, 0o600)
+        return os.open(name, os.O_RDONLY|os.O_NONBLOCK), name
+    except (AttributeError, OSError): # e.g. on windows
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return None, None
+
+def close_signal(fd, name):
+    """close and remove the named pipe (see open_signal)"""
+    import os, shutil
+    if fd is not None: os.close(fd)
+    if name is not None:
+        shutil.rmtree(os.path.dirname(name), ignore_errors=True)
+    return
+
+def wait_signal(fd, timeout):
+    """wait until the named pipe is signaled, or for timeout seconds
+
+fd: file descriptor of the named pipe (or None, to just wait for timeout)
+timeout: float maximum number of seconds to wait
+
+returns False if the writer has closed the pipe, and True otherwise"""
+    if fd is None:
+        from time import sleep
+        sleep(timeout)
+        return True
+    import os, select
+    if not select.select([fd], [], [], timeout)[0]: return True
+    try: # drain the signals
+        return bool(os.read(fd, 4096))
+    except OSError:
+        return True
+
+def _read_record(file, loads):
+    """read the next record from the results file, or None if not yet written"""
+    import struct
+    position = file.tell()
+    size = file.read(struct.calcsize(_RECORD))
+    if len(size) == struct.calcsize(_RECORD):
+        size, = struct.unpack(_RECORD, size)
+        record = file.read(size)
+        if len(record) == size:
+            return loads(decompress(record))
+    file.seek(position)
+    return None
+
+def iload_results(filename, alive=None, signal=None, serializer=None):
+    """iterate over the records in a results file, as they are written
+
+filename: path to the results file
+alive: function that returns False once the writer has stopped [default: None]
+signal: file descriptor of a named pipe for the file (see open_signal)
+serializer: name of the serializer for the records [default: 'dill']
+
+yields (begin, results) records, in the order they were written
+
+NOTE: if alive is None, wait until the results file is complete; otherwise,
+raise IOError if the writer stops before the results file is complete.
+If signal is None, poll for new records with an exponential backoff."""
+    import os
+    loads = get_serializer(serializer)[1]
+    delay = 1e-4
+    file = None
+    try:
+        while True:
+            done = results_ready(filename) # all records are now written
+            if file is None and os.path.exists(filename):
+                file = open(filename, 'rb')
+                file.seek(len(_HEADER)+1)
+            record = None if file is None else _read_record(file, loads)
+            if record is not None:
+                yield record
+                delay = 1e-4
+                continue
+            if done: break
+            if alive is not None and not alive() and not results_ready(filename):
+                raise IOError("incomplete results: %s" % filename)
+            if not wait_signal(signal, delay): # the writer has closed
+                signal = None
+            delay = min(2*delay, 0.1)
+    finally:
+        if file is not None: file.close()
+    return
+
+def load_results(filename, alive=None, signal=None, serializer=None):
+    """get the list of results from a results file (see iload_results)"""
+    results = []
+    for begin, chunk in iload_results(filename, alive, signal, serializer):
+        end = begin + len(chunk)
+        if len(results) < end: results.extend([''] * (end - len(results)))
+        results[begin:end] = chunk
+    return results
+
+def timed_map(func, begin, *inputs):
+    """map func across the inputs, recording the time spent on each task
+
+func: the function to map
+begin: int index of the first of the inputs in the map
+inputs: sequences of arguments to func
+
+returns (results, tasks), where tasks is a list of (index, start, stop)"""
+    import time
+    results, tasks = [], []
+    for index, args in enumerate(zip(*inputs), begin):
+        start = time.time()
+        results.append(func(*args))
+        tasks.append((index, start, time.time()))
+    return results, tasks
+
+def _piece(func, begin, timed, *inputs):
+    """map func across a piece of a chunk, returning (results, tasks)"""
+    if timed: return timed_map(func, begin, *inputs)
+    return list(map(func, *inputs)), []
+
+def fanout(pool, nproc, func, begin, *inputs, **kwds):
+    """map func across the inputs, in contiguous pieces on a local pool
+
+pool: a local process pool, with starmap_async (e.g. multiprocess.Pool)
+nproc: int number of pieces (i.e. the number of processes in the pool)
+func: the function to map
+begin: int index of the first of the inputs in the map
+inputs: sequences of arguments to func
+timed: if True, record the time spent on each task [default: False]
+
+returns an asynchronous result, where the pieces can be joined with fanin"""
+    timed = bool(kwds.get('timed', False))
+    njobs = len(inputs[0]) if inputs else 0
+    npieces = max(min(nproc, njobs), 1) # no empty pieces
+    pieces = []
+    for index in range(npieces):
+        ib, ie = get_workload(index, npieces, njobs)
+        pieces.append((func, begin + ib, timed) + lookup(inputs, ib, ie))
+    return pool.starmap_async(_piece, pieces)
+
+def fanin(pieces):
+    """join the (results, tasks) of the pieces of a chunk (see fanout)"""
+    results, tasks = [], []
+    for (result, task) in pieces:
+        results.extend(result)
+        tasks.extend(task)
+    return results, tasks
+
+class Recorder(object):
+    """record the time spent on the tasks and messages on a rank of a map
+
+rank: int rank of the node
+enabled: if False, only phases are recorded (i.e. map is just a map)
+
+NOTE: times are from time.time(), so the times on different hosts are only
+comparable if their clocks are synchronized. The time of a send or a recv
+includes the time to pickle or unpickle the message."""
+    def __init__(self, rank, enabled=True):
+        import time
+        self.rank = rank
+        self.enabled = enabled
+        self.start = time.time()
+        self.tasks = []    # (index, start, stop) for each task
+        self.messages = [] # (kind, peer, nbytes, start, stop) for each message
+        self.spans = []    # (kind, start, stop) for each wait
+        self.waits = {}    # total time spent, for each kind of message or wait
+        self.nbytes = {}   # total bytes, for each kind of message
+        self.phases = {}   # total time spent, for each phase of the map
+        self.stats = None  # the aggregated stats, on the root after gather
+        return
+    def map(self, func, begin, *inputs):
+        """map func across the inputs, recording each task (see timed_map)"""
+        if not self.enabled: return list(map(func, *inputs))
+        results, tasks = timed_map(func, begin, *inputs)
+        self.tasks.extend(tasks)
+        return results
+    def wait(self, kind, start, stop=None):
+        """record time spent waiting (e.g. kind='recv') since start"""
+        if not self.enabled: return
+        import time
+        if stop is None: stop = time.time()
+        self.spans.append((kind, start, stop))
+        self.waits[kind] = self.waits.get(kind, 0.) + stop - start
+        return
+    def phase(self, name, start, stop=None):
+        """record time spent in a phase (e.g. name='load') since start
+
+NOTE: phases are recorded even if not enabled, and also as a wait if enabled"""
+        import time
+        if stop is None: stop = time.time()
+        self.phases[name] = self.phases.get(name, 0.) + stop - start
+        self.wait(name, start, stop)
+        return
+    def timed(self, name, func):
+        """get a function that calls func, recording the time as a phase"""
+        import time
+        def timed(*args, **kwds):
+            start = time.time()
+            try:
+                return func(*args, **kwds)
+            finally:
+                self.phase(name, start)
+        return timed
+    def message(self, kind, peer, nbytes, start, stop=None):
+        """record a message (e.g. kind='send') with a peer rank, since start"""
+        if not self.enabled: return
+        import time
+        if stop is None: stop = time.time()
+        self.messages.append((kind, peer, nbytes, start, stop))
+        self.nbytes[kind] = self.nbytes.get(kind, 0) + nbytes
+        self.waits[kind] = self.waits.get(kind, 0.) + stop - start
+        return
+    def gather(self, comm, root=0, **info):
+        """gather the records from all ranks, and aggregate them on the root
+
+comm: mpi communicator, where all ranks call gather
+root: int rank of the node that aggregates the records
+info: additional items for the aggregate (e.g. strategy='mpi_pool')
+
+returns a dict of stats on the root, and None otherwise (see merge_stats)"""
+        import time
+        stop = time.time()
+        record = dict(rank=self.rank, start=self.start, stop=stop,
+                      tasks=self.tasks, messages=self.messages,
+                      spans=self.spans, waits=self.waits, nbytes=self.nbytes)
+        records = comm.gather(record, root=root)
+        if records is None: return None
+        self.stats = merge_stats(records, **info)
+        return self.stats
+
+def merge_stats(records, **info):
+    """aggregate the records from each rank of a map (see Recorder.gather)
+
+records: list of dict of the records on each rank
+info: additional items for the aggregate
+
+returns a dict with the elapsed time of the map, a summary for each rank,
+and a list of each task, message, and wait (with times relative to the start)"""
+    start = min(record['start'] for record in records)
+    stop = max(record['stop'] for record in records)
+    ranks, tasks, messages, spans = [], [], [], []
+    for record in records:
+        rank = record['rank']
+        compute = sum(t[2] - t[1] for t in record['tasks'])
+        elapsed = record['stop'] - record['start']
+        ranks.append(dict(rank=rank, ntasks=len(record['tasks']),
+                          compute=compute, idle=elapsed - compute,
+                          waits=record['waits'], nbytes=record['nbytes'],
+                          nmessages=len(record['messages'])))
+        tasks.extend((rank, i, t0 - start, t1 - start) \
+                     for (i, t0, t1) in record['tasks'])
+        messages.extend((rank, kind, peer, n, t0 - start, t1 - start) \
+                        for (kind, peer, n, t0, t1) in record['messages'])
+        spans.extend((rank, kind, t0 - start, t1 - start) \
+                     for (kind, t0, t1) in record.get('spans', ()))
+    result = dict(info, start=start, elapsed=stop - start, ranks=ranks,
+                  tasks=sorted(tasks, key=lambda t: t[2]),
+                  messages=sorted(messages, key=lambda m: m[4]),
+                  spans=sorted(spans, key=lambda s: s[2]))
+    return result
+
+def trace_events(stats):
+    """convert the stats of a map to a list of Chrome trace events
+
+stats: dict of stats (see merge_stats)
+
+returns a list of 'complete' events, with one thread for each rank, where
+each task, message, and wait is a span (with times in microseconds)"""
+    name = stats.get('strategy', 'map')
+    events = [dict(ph='M', name='process_name', pid=0, args=dict(name=name))]
+    for rank in stats['ranks']:
+        events.append(dict(ph='M', name='thread_name', pid=0, tid=rank['rank'],
+                           args=dict(name='rank %s' % rank['rank'])))
+    span = lambda name, cat, rank, t0, t1, **args: \
+        dict(ph='X', name=name, cat=cat, pid=0, tid=rank, ts=t0 * 1e6,
+             dur=(t1 - t0) * 1e6, args=args)
+    for (rank, index, t0, t1) in stats['tasks']:
+        events.append(span('task %s' % index, 'task', rank, t0, t1, index=index))
+    for (rank, kind, peer, nbytes, t0, t1) in stats['messages']:
+        events.append(span(kind, 'message', rank, t0, t1, peer=peer, nbytes=nbytes))
+    for (rank, kind, t0, t1) in stats.get('spans', ()):
+        events.append(span(kind, 'wait', rank, t0, t1))
+    return events
+
+def dump_trace(filename, stats):
+    """write the stats of a map as a Chrome trace (e.g. for chrome://tracing)
+
+filename: path to the trace file (e.g. 'run.json')
+stats: dict of stats (see merge_stats)"""
+    import json
+    trace = dict(traceEvents=trace_events(stats), displayTimeUnit='ms',
+                 otherData=dict((k, v) for (k, v) in stats.items() \
+                                if not isinstance(v, (list, dict))))
+    with open(filename, 'w') as file:
+        json.dump(trace, file)
+    return
+
+def _statsname(filename):
+    """get the path to the stats file for the given results file"""
+    return filename + '.stats'
+
+def dump_stats(filename, stats):
+    """write the stats of a map to a json file beside the results file
+
+filename: path to the results file
+stats: dict of stats (see merge_stats)"""
+    import json
+    with open(_statsname(filename), 'w') as file:
+        json.dump(stats, file)
+    return
+
+def load_stats(filename):
+    """load the stats of a map from beside the results file (or None)"""
+    import json
+    try:
+        with open(_statsname(filename)) as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return None
+
+class CostModel(object):
+    """a model of the cost of a map, learned from the time of previous maps
+
+filename: path to the json file where the costs are cached (or None)
+
+The time of a map of n items on a pool of size nodes is modeled as
+overhead + n * cost / nodes, where the overhead is learned for each launcher
+(e.g. 'MpiPool(4)'), and the cost of an item is learned for each function.
+The 'serial' launcher has no overhead, and the 'local' launcher (a process
+pool on the local host) has a small default overhead until it is learned."""
+    rate = 0.5 # the weight of a new time, when averaged with the old
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.costs = {}     # the time of an item, for each function
+        self.overheads = {'serial': 0., 'local': 0.1} # for each launcher
+        self.load()
+        return
+    def load(self):
+        """update the model with the costs cached in the file (if any)"""
+        import json
+        if not self.filename: return
+        try:
+            with open(self.filename) as file:
+                cached = json.load(file)
+        except (IOError, ValueError):
+            return
+        self.costs.update(cached.get('costs', {}))
+        self.overheads.update(cached.get('overheads', {}))
+        return
+    def save(self):
+        """write the costs to the file (if any)"""
+        import os, json
+        if not self.filename: return
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.exists(directory): os.makedirs(directory)
+        temp = '%s.%s' % (self.filename, os.getpid())
+        with open(temp, 'w') as file:
+            json.dump(dict(costs=self.costs, overheads=self.overheads), file)
+        os.replace(temp, self.filename) # so readers never see a partial file
+        return
+    def __average(self, old, new):
+        if old is None: return new
+        return old + self.rate * (new - old)
+    def update(self, key, launcher, nitems, nodes, elapsed, overhead=None):
+        """update the model with the time of a map
+
+key: str name of the function
+launcher: str name of the launcher (e.g. 'serial', 'local', 'MpiPool(4)')
+nitems: int number of items in the map
+nodes: int size of the pool
+elapsed: float total time of the map, in seconds
+overhead: float time of the map, other than the compute (or None)
+
+NOTE: if overhead is None, only the overhead is learned (from the cost)"""
+        if nitems <= 0: return
+        if overhead is None: # learn the overhead from the cost of the items
+            cost = self.costs.get(key, None)
+            if cost is None: return
+            overhead = max(elapsed - nitems * cost / nodes, 0.)
+        else: # learn the cost of the items from the compute
+            cost = max(elapsed - overhead, 0.) * nodes / nitems
+            self.costs[key] = self.__average(self.costs.get(key, None), cost)
+        if launcher != 'serial':
+            old = self.overheads.get(launcher, None)
+            self.overheads[launcher] = self.__average(old, overhead)
+        return
+    def predict(self, key, launcher, nitems, nodes):
+        """get the predicted time of a map (or None, if it can't be predicted)"""
+        cost = self.costs.get(key, None)
+        overhead = self.overheads.get(launcher, None)
+        if cost is None or overhead is None: return None
+        return overhead + nitems * cost / nodes
+    def choose(self, key, launcher, nitems, nodes, ncpus=1):
+        """choose where to run a map, from the predicted time of the map
+
+key: str name of the function
+launcher: str name of the launcher (e.g. 'MpiPool(4)')
+nitems: int number of items in the map
+nodes: int size of the pool
+ncpus: int size of a process pool on the local host
+
+returns 'serial' or 'local' if predicted to be faster than the launcher, and
+otherwise returns None (i.e. if the time of the launcher is not known yet)"""
+        launched = self.predict(key, launcher, nitems, nodes)
+        if launched is None: return None
+        times = [(launched, None),
+                 (self.predict(key, 'serial', nitems, 1), 'serial'),
+                 (self.predict(key, 'local', nitems, ncpus), 'local')]
+        return min(times, key=lambda t: t[0])[1]
+
+# shared args files are written as a header, the pickle, then the buffers
+_ARGS = b'pyina-args:' # followed by the sizes of the pickle and the buffers
+_ALIGN = 64 # the alignment of the pickle and the buffers in the file
+
+def _align(offset):
+    """round the offset up to the next multiple of _ALIGN"""
+    return -(-offset // _ALIGN) * _ALIGN
+
+class _ArgsPickler(dill.Pickler):
+    """pickler that saves the data of ndarrays out-of-band, in self.buffers"""
+    def __init__(self, *args, **kwds):
+        dill.Pickler.__init__(self, *args, **kwds)
+        self.buffers = []
+    def persistent_id(self, obj):
+        if type(obj) is not np.ndarray or obj.dtype.hasobject or \
+           obj.dtype.fields is not None or not obj.nbytes:
+            return None
+        if obj.flags.c_contiguous: order = 'C'
+        elif obj.flags.f_contiguous: order = 'F'
+        else: return None
+        self.buffers.append(obj.reshape(-1, order=order).view(np.uint8))
+        return ('ndarray', len(self.buffers)-1, obj.dtype.str, obj.shape, order)
+
+class _ArgsUnpickler(dill.Unpickler):
+    """unpickler that loads ndarrays as views of the given buffers"""
+    def __init__(self, file, buffers, **kwds):
+        dill.Unpickler.__init__(self, file, **kwds)
+        self.buffers = buffers
+    def persistent_load(self, pid):
+        kind, index, dtype, shape, order = pid
+        array = np.frombuffer(self.buffers[index], dtype=dtype)
+        return array.reshape(shape, order=order)
+
+def dump_args(args, kwds, file):
+    """write the args and kwds for a map to an open file, for sharing on a node
+
+args: tuple of sequences of arguments to the mapped function
+kwds: dict of keyword arguments to the map
+file: file open for writing in binary mode
+
+NOTE: the data of any contiguous ndarray is written as a raw buffer, so it
+can be loaded as a read-only view of shared memory (see load_args)."""
+    import io, struct
+    pickled = io.BytesIO()
+    pickler = _ArgsPickler(pickled)
+    pickler.dump((args, kwds))
+    pickled = pickled.getbuffer()
+    buffers = pickler.buffers
+    header = _ARGS + struct.pack('<QQ', len(pickled), len(buffers))
+    header += struct.pack('<%dQ' % len(buffers), *(b.nbytes for b in buffers))
+    offset = 0
+    for data in [header, pickled] + buffers:
+        file.write(b'\x00' * (_align(offset) - offset))
+        file.write(data)
+        offset = _align(offset) + len(data)
+    return
+
+# sharded args files are written as a header, the pickled kwds, an index
+# for each sequence of args, then each sequence pickled in blocks of items
+_SHARDS = b'pyina-shards:' # followed by the size of the kwds, and #sequences
+
+class _Sharded(object):
+    """a sequence of args, where each slice is read from a sharded args file"""
+    def __init__(self, filename, length, blocksize, offsets):
+        """
+filename: path to the sharded args file (see dump_sharded)
+length: int number of items in the sequence
+blocksize: int number of items in each block
+offsets: list of int, the position of each block (and the end) in the file
+        """
+        self.filename = filename
+        self.length = length
+        self.blocksize = blocksize
+        self.offsets = offsets
+    def __len__(self):
+        return self.length
+    def __iter__(self):
+        return iter(self[:])
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            if index < 0: index += self.length
+            if not 0 <= index < self.length:
+                raise IndexError("index out of range")
+            return self[index:index+1][0]
+        start, stop, step = index.indices(self.length)
+        if step < 0: return self[:][index]
+        if start >= stop: return []
+        # read the blocks that hold the items [start:stop]
+        first, last = start // self.blocksize, -(-stop // self.blocksize)
+        base = self.offsets[first]
+        with open(self.filename, 'rb') as file:
+            file.seek(base)
+            data = memoryview(file.read(self.offsets[last] - base))
+        items = []
+        for i in range(first, last):
+            block = data[self.offsets[i]-base:self.offsets[i+1]-base]
+            items.extend(dill.loads(decompress(block)))
+        base = first * self.blocksize
+        return items[start-base:stop-base:step]
+
+def dump_sharded(args, kwds, file, nblocks=1024, compression=None):
+    """write the args and kwds for a map to an open file, so slices can be read
+
+args: tuple of sequences of arguments to the mapped function
+kwds: dict of keyword arguments to the map
+file: file open for writing in binary mode
+nblocks: int maximum number of blocks for each sequence [default: 1024]
+compression: name of a compressor for the blocks [default: None]
+
+NOTE: each sequence of args is pickled in contiguous blocks of items, with an
+index of the position of each block, so a rank can read only the blocks that
+hold its slice of the args (see load_args)."""
+    import struct
+    pickled = dill.dumps(kwds)
+    file.write(_SHARDS + struct.pack('<QQ', len(pickled), len(args)))
+    file.write(pickled)
+    for arg in args:
+        length = len(arg)
+        blocksize = max(-(-length // nblocks), 1)
+        blocks = range(0, length, blocksize)
+        # reserve space for the header and index, then write the blocks
+        header = file.tell()
+        file.write(b'\x00' * (16 + 8 * (len(blocks)+1)))
+        offsets = []
+        for i in blocks:
+            offsets.append(file.tell())
+            file.write(compress(dill.dumps(arg[i:i+blocksize]), compression))
+        offsets.append(file.tell())
+        file.seek(header)
+        file.write(struct.pack('<QQ', length, blocksize))
+        file.write(struct.pack('<%dQ' % len(offsets), *offsets))
+        file.seek(offsets[-1])
+    return
+
+def _load_sharded(filename):
+    """load the kwds, and the index for each sequence of args (see dump_sharded)"""
+    import struct
+    with open(filename, 'rb') as file:
+        file.seek(len(_SHARDS))
+        size, count = struct.unpack('<QQ', file.read(16))
+        kwds = dill.loads(file.read(size))
+        args = []
+        for i in range(count):
+            length, blocksize = struct.unpack('<QQ', file.read(16))
+            nblocks = -(-length // blocksize) + 1
+            offsets = struct.unpack('<%dQ' % nblocks, file.read(8 * nblocks))
+            args.append(_Sharded(filename, length, blocksize, offsets))
+            file.seek(offsets[-1])
+    return tuple(args), kwds
+
+# arrays args files are written as a header, then the pickled args and kwds,
+# where each ndarray in the args is saved to a '.npy' file beside the args file
+_ARRAYS = b'pyina-arrays:'
+
+class _ArraysPickler(dill.Pickler):
+    """pickler that saves the given ndarrays by the name of their '.npy' file"""
+    def __init__(self, file, arrays, **kwds):
+        dill.Pickler.__init__(self, file, **kwds)
+        self.arrays = arrays
+    def persistent_id(self, obj):
+        return self.arrays.get(id(obj), None)
+
+class _ArraysUnpickler(dill.Unpickler):
+    """unpickler that loads ndarrays as copy-on-write memory maps of '.npy' files"""
+    def __init__(self, file, dirname, **kwds):
+        dill.Unpickler.__init__(self, file, **kwds)
+        self.dirname = dirname
+    def persistent_load(self, pid):
+        import os
+        kind, name = pid
+        # changes are made to private copies of the pages, not to the file
+        array = np.load(os.path.join(self.dirname, name), mmap_mode='c')
+        return array.view(np.ndarray) # the view holds the memory map open
+
+def dump_arrays(args, kwds, file):
+    """write the args and kwds for a map to an open file, saving ndarrays as .npy
+
+args: tuple of sequences of arguments to the mapped function
+kwds: dict of keyword arguments to the map
+file: named file open for writing in binary mode
+
+returns the list of paths to the '.npy' files that were written
+
+NOTE: each sequence of args that is an ndarray (without objects) is saved as
+'<file.name>.<index>.npy', so it can be loaded as a copy-on-write memory map,
+where only the rows that are used are read from the file (see load_args)."""
+    import os
+    arrays, filenames = {}, []
+    for i, arg in enumerate(args):
+        if type(arg) is not np.ndarray or arg.dtype.hasobject: continue
+        filename = '%s.%d.npy' % (file.name, i)
+        np.save(filename, arg, allow_pickle=False)
+        arrays[id(arg)] = ('npy', os.path.basename(filename))
+        filenames.append(filename)
+    file.write(_ARRAYS)
+    _ArraysPickler(file, arrays).dump((args, kwds))
+    return filenames
+
+def load_args(filename, comm=None):
+    """load the args and kwds for a map from the given file
+
+filename: path to the file of args and kwds (see dump_args)
+comm: mpi communicator, where all ranks load the file [default: None]
+
+returns (args, kwds, window), where window is the shared memory (or None)
+
+NOTE: a compressed file, or compressed blocks, are detected and decompressed.
+If the file was written with dump_arrays, the ndarrays in the args are
+copy-on-write memory maps of the '.npy' files (which must exist while the args
+are used), thus changes to the args are not written to the files. If the file was written with dump_sharded, the args are sequences that
+read only the requested slice from the file (thus the file must exist while
+the args are used). If the file was written with dump_args and comm is given,
+only one rank on each node reads the file (into shared memory), and the
+ndarrays in the args are read-only views of the shared memory. Otherwise,
+each rank reads the file. The window should be freed (with window.Free(), on
+all ranks) only after the args are no longer used."""
+    import os, struct
+    with open(filename, 'rb') as file:
+        magic = file.read(max(len(_ARGS), len(_SHARDS), len(_ARRAYS), len(_ZIP)))
+        if magic.startswith(_SHARDS): # each slice is read when needed
+            args, kwds = _load_sharded(filename)
+            return args, kwds, None
+        if magic.startswith(_ARRAYS): # each ndarray is mapped from a file
+            file.seek(len(_ARRAYS))
+            dirname = os.path.dirname(os.path.abspath(filename))
+            args, kwds = _ArraysUnpickler(file, dirname).load()
+            return args, kwds, None
+        if magic.startswith(_ZIP): # a compressed pickle (see compress)
+            file.seek(0)
+            args, kwds = dill.loads(decompress(file.read()))
+            return args, kwds, None
+        if not magic.startswith(_ARGS): # a pickle (see dill.temp.dump)
+            file.seek(0)
+            args, kwds = dill.load(file)
+            return args, kwds, None
+    window = None
+    if comm is not None:
+        from mpi4py import MPI
+        node = comm.Split_type(MPI.COMM_TYPE_SHARED)
+        size = os.path.getsize(filename) if node.rank == 0 else 0
+        try: # one rank on the node reads the file into shared memory
+            window = MPI.Win.Allocate_shared(size, 1, comm=node)
+        except (NotImplementedError, MPI.Exception):
+            pass
+        else:
+            data = memoryview(window.Shared_query(0)[0])
+            if node.rank == 0:
+                with open(filename, 'rb') as file:
+                    file.readinto(data)
+            node.Barrier()
+        node.Free()
+    if window is None:
+        with open(filename, 'rb') as file:
+            data = memoryview(file.read())
+    data = data.toreadonly()
+    # find the pickle and the buffers in the file
+    offset = len(_ARGS)
+    size, count = struct.unpack_from('<QQ', data, offset)
+    sizes = struct.unpack_from('<%dQ' % count, data, offset+16)
+    offset = _align(offset + 16 + 8*count)
+    pickled = data[offset:offset+size]
+    buffers = []
+    offset = _align(offset + size)
+    for size in sizes:
+        buffers.append(data[offset:offset+size])
+        offset = _align(offset + size)
+    import io
+    args, kwds = _ArgsUnpickler(io.BytesIO(pickled), buffers).load()
+    return args, kwds, window
+
 def isoseconds(time):
     """calculate number of seconds from a given isoformat timestring"""
     from numbers import Integral
@@ -213,6 +1147,19 @@ def which_strategy(scatter=True, lazy=False, fullpath=True):
     if not target: target = None #XXX: better None or "" ?
     return target
 
+def which_server(lazy=False, fullpath=True):
+    """try to autodetect the helper script for a persistent mpi world"""
+    target = 'ezserver'
+    import sys
+    if (sys.platform[:3] == 'win'): lazy=False
+    if lazy: target = "`which %s`" % target
+    # lookup full path
+    elif not lazy and fullpath:
+        from pox import which
+        target = which(target, ignore_errors=True)
+    if not target: target = None
+    return target
+
 
 def which_python(lazy=False, fullpath=True):
     "get an invocation for this python on the execution path"
@@ -234,7 +1181,6 @@ from pox import wait_for
 if __name__=='__main__':
     n = 7 #12
     pop = 12 #7 
-    #FIXME: the two ways to calculate now have diverged
     assert get_workload(0, n, pop) == balance_workload(n, pop, 0)
     assert [get_workload(i, n, pop) for i in range(n)] == \
                                          list(zip(*balance_workload(n, pop)))
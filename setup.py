@@ -93,7 +93,8 @@ setup_kwds = dict(
     ],
     packages=['pyina','pyina.tests'],
     package_dir={'pyina':'pyina','pyina.tests':'pyina/tests'},
-    scripts=['scripts/ezpool','scripts/ezscatter','scripts/mpi_world'],
+    scripts=['scripts/ezpool','scripts/ezscatter','scripts/ezserver',
+             'scripts/mpi_world'],
 )
 
 # force python-, abi-, and platform-specific naming of bdist_wheel